@@ -1,19 +1,30 @@
 import uuid
-from sqlalchemy import Column, ForeignKey, DateTime
+from sqlalchemy import Column, ForeignKey, DateTime, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from pgvector.sqlalchemy import Vector
 from db.base import Base
 
+# SpeechBrain ECAPA (spkrec-ecapa-voxceleb) speaker embedding size
+EMBEDDING_DIM = 192
+
 class Embedding(Base):
     __tablename__ = "embeddings"
+    __table_args__ = (
+        Index(
+            "ix_embeddings_vector_hnsw",
+            "vector",
+            postgresql_using="hnsw",
+            postgresql_ops={"vector": "vector_cosine_ops"},
+        ),
+    )
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     speaker_id = Column(UUID(as_uuid=True), ForeignKey("speakers.id"), nullable=False)
-    vector = Column(Vector(768), nullable=False)
+    vector = Column(Vector(EMBEDDING_DIM), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
     # Relationships
-    speaker = relationship("Speaker", back_populates="embeddings") 
\ No newline at end of file
+    speaker = relationship("Speaker", back_populates="embeddings") 
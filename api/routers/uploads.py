@@ -7,6 +7,7 @@ from typing import Optional
 from fastapi import APIRouter, Depends, File, UploadFile, Form, HTTPException
 from sqlalchemy.orm import Session
 from rq import Queue
+from rq.serializers import JSONSerializer
 from redis import Redis
 from db.session import get_db
 from models.job import Job
@@ -19,7 +20,8 @@ router = APIRouter()
 
 # Initialize Redis and RQ
 redis_conn = Redis.from_url(settings.REDIS_URL)
-queue = Queue("voicestack2", connection=redis_conn)
+# Job arguments are plain JSON (ids, paths, params), so skip pickle; the worker must match
+queue = Queue("voicestack2", connection=redis_conn, serializer=JSONSerializer)
 
 def get_file_extension(filename: str) -> str:
     """Extract file extension from filename."""
@@ -100,7 +102,8 @@ async def upload_file(
             str(job.id),
             input_path,
             job_params,
-            job_timeout=3600  # 1 hour timeout
+            job_timeout=3600,  # 1 hour timeout
+            result_ttl=0  # Job status lives in Postgres; skip storing the RQ return value
         )
     except Exception as e:
         # If enqueue fails, mark job as failed
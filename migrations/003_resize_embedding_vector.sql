@@ -0,0 +1,23 @@
+-- Migration: Size speaker embeddings for ECAPA and index them
+-- Date: 2026-10-15
+-- Description: SpeechBrain ECAPA produces 192-dim vectors, which vector(768) rejects.
+-- Resize the embeddings.vector column and add an HNSW cosine index for nearest-speaker search.
+
+-- Resize embeddings.vector to 192 dimensions (pgvector stores the dimension as atttypmod)
+DO $$ 
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_attribute 
+        WHERE attrelid = 'embeddings'::regclass 
+        AND attname = 'vector' 
+        AND atttypmod <> 192
+    ) THEN
+        ALTER TABLE embeddings ALTER COLUMN vector TYPE vector(192);
+        RAISE NOTICE 'Resized embeddings.vector to vector(192)';
+    ELSE
+        RAISE NOTICE 'embeddings.vector is already vector(192)';
+    END IF;
+END $$;
+
+-- Add HNSW cosine index on embeddings.vector
+CREATE INDEX IF NOT EXISTS ix_embeddings_vector_hnsw ON embeddings USING hnsw (vector vector_cosine_ops);
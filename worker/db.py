@@ -6,10 +6,11 @@ import os
 import sys
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+# Load environment variables from .env unless the container already provides them
+if os.getenv("SKIP_DOTENV") != "1":
+    from dotenv import load_dotenv
+    load_dotenv()
 
 # Get the API source directory from environment variable
 api_dir = os.getenv("API_SRC_DIR", "/app/api")
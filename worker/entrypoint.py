@@ -7,6 +7,7 @@ import os
 import signal
 import sys
 from rq import Worker, Queue, Connection
+from rq.serializers import JSONSerializer
 from redis import Redis
 from dotenv import load_dotenv
 
@@ -29,14 +30,14 @@ def main():
     redis_conn = Redis.from_url(redis_url)
     
     # Create queue
-    queue = Queue("voicestack2", connection=redis_conn)
+    queue = Queue("voicestack2", connection=redis_conn, serializer=JSONSerializer)
     
     print(f"Starting RQ worker on queue: voicestack2")
     print(f"Redis URL: {redis_url}")
     
     # Start worker
     with Connection(redis_conn):
-        worker = Worker([queue])
+        worker = Worker([queue], serializer=JSONSerializer)
         worker.work()
 
 if __name__ == "__main__":
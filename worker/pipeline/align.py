@@ -6,6 +6,8 @@ import os
 import json
 from typing import Dict, Any, List
 import whisperx
+from pipeline.audio import load_audio_16k
+from pipeline.gpu_mutex import release_gpu_memory
 
 def align_with_whisperx(audio_path: str, asr_result: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -15,7 +17,7 @@ def align_with_whisperx(audio_path: str, asr_result: Dict[str, Any]) -> Dict[str
     device = "cuda" if torch.cuda.is_available() else "cpu"
     
     # Load audio
-    audio = whisperx.load_audio(audio_path)
+    audio = load_audio_16k(audio_path)
     
     # Load alignment model
     model_a, metadata = whisperx.load_align_model(
@@ -26,15 +28,19 @@ def align_with_whisperx(audio_path: str, asr_result: Dict[str, Any]) -> Dict[str
     # Prepare segments for alignment
     segments = asr_result["segments"]
     
-    # Perform alignment
-    result = whisperx.align(
-        segments,
-        model_a,
-        metadata,
-        audio,
-        device,
-        return_char_alignments=False
-    )
+    # Perform alignment, then free the model's GPU memory for the next stage
+    try:
+        result = whisperx.align(
+            segments,
+            model_a,
+            metadata,
+            audio,
+            device,
+            return_char_alignments=False
+        )
+    finally:
+        del model_a
+        release_gpu_memory()
     
     # Extract aligned words
     aligned_words = []
@@ -9,6 +9,13 @@ from datetime import datetime
 from pathlib import Path
 from typing import Dict, Any, List
 
+# Optional fast JSON encoder for large transcript artifacts
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 def ensure_artifacts_dir(job_id: str) -> str:
     """Ensure artifacts directory exists and return path."""
     artifacts_dir = os.path.join("/data/artifacts", job_id)
@@ -33,8 +40,22 @@ def write_json(job_id: str, filename: str, data: Dict[str, Any]):
     artifacts_dir = ensure_artifacts_dir(job_id)
     filepath = os.path.join(artifacts_dir, filename)
     
-    with open(filepath, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    encoded = None
+    if ORJSON_AVAILABLE:
+        try:
+            encoded = orjson.dumps(
+                data,
+                option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+            )
+        except TypeError:
+            pass  # Types orjson can't encode go through json below
+    
+    if encoded is not None:
+        with open(filepath, "wb") as f:
+            f.write(encoded)
+    else:
+        with open(filepath, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
     
     log_step(job_id, f"Wrote {filename}")
 
@@ -7,6 +7,9 @@ import json
 from typing import Dict, Any, List
 from pipeline.artifacts import log_step, write_json
 
+# Transformers ASR is also the fallback when faster-whisper fails at runtime
+from pipeline.asr_transformers import transcribe_audio_transformers, transcribe_with_simple_chunking
+
 # Try faster-whisper first, fall back to transformers
 try:
     from faster_whisper import WhisperModel
@@ -16,7 +19,6 @@ except ImportError as e:
     print(f"faster-whisper not available: {e}")
     print("Using transformers fallback")
     FASTER_WHISPER_AVAILABLE = False
-    from pipeline.asr_transformers import transcribe_audio_transformers, transcribe_with_simple_chunking
 
 def load_whisper_model(model_name: str = "base", compute_type: str = "float16"):
     """Load faster-whisper model."""
@@ -117,6 +119,7 @@ def transcribe_audio(audio_path: str, model_name: str = "base", compute_type: st
 def transcribe_with_chunking(audio_path: str, model_name: str = "base", compute_type: str = "float16", chunk_duration: int = 30) -> Dict[str, Any]:
     """Transcribe long audio files by chunking."""
     import librosa
+    import soundfile as sf
     
     # Get audio duration
     duration = librosa.get_duration(path=audio_path)
@@ -152,7 +155,7 @@ def transcribe_with_chunking(audio_path: str, model_name: str = "base", compute_
             
             # Save temporary chunk file
             temp_chunk_path = f"/tmp/chunk_{i}.wav"
-            librosa.output.write_wav(temp_chunk_path, chunk, sr)
+            sf.write(temp_chunk_path, chunk, sr)
             
             try:
                 # Transcribe chunk
@@ -163,32 +166,32 @@ def transcribe_with_chunking(audio_path: str, model_name: str = "base", compute_
                 
                 # Adjust timestamps and add to results
                 for segment in chunk_segments:
-                segment_dict = {
-                    "start": segment.start + current_time,
-                    "end": segment.end + current_time,
-                    "text": segment.text.strip(),
-                    "words": []
-                }
+                    segment_dict = {
+                        "start": segment.start + current_time,
+                        "end": segment.end + current_time,
+                        "text": segment.text.strip(),
+                        "words": []
+                    }
+                    
+                    # Adjust word timestamps
+                    if segment.words:
+                        for word in segment.words:
+                            segment_dict["words"].append({
+                                "word": word.word,
+                                "start": word.start + current_time,
+                                "end": word.end + current_time,
+                                "probability": word.probability
+                            })
+                    
+                    segments_list.append(segment_dict)
                 
-                # Adjust word timestamps
-                if segment.words:
-                    for word in segment.words:
-                        segment_dict["words"].append({
-                            "word": word.word,
-                            "start": word.start + current_time,
-                            "end": word.end + current_time,
-                            "probability": word.probability
-                        })
+                current_time += chunk_duration - (overlap_samples / sr)
                 
-                segments_list.append(segment_dict)
-            
-            current_time += chunk_duration - (overlap_samples / sr)
-            
-        finally:
-            # Clean up temp file
-            if os.path.exists(temp_chunk_path):
-                os.remove(temp_chunk_path)
-    
+            finally:
+                # Clean up temp file
+                if os.path.exists(temp_chunk_path):
+                    os.remove(temp_chunk_path)
+        
         return {
             "segments": segments_list,
             "language": "en",  # Default for chunked processing
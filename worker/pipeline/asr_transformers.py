@@ -5,14 +5,45 @@ This version avoids ctranslate2 dependency issues
 
 import os
 import json
+import numpy as np
 import torch
 import torchaudio
 import soundfile as sf
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 from transformers import pipeline, AutoModelForSpeechSeq2Seq, AutoProcessor
 from pipeline.artifacts import log_step, write_json
+from pipeline.gpu_mutex import park_modules, unpark_modules
+from pipeline.audio import map_wav_pcm16
+
+# Process-wide pipeline cache keyed by model name to avoid reloading per job
+_pipeline_cache = {}
+
+# Silero VAD model and its speech-timestamp function, loaded once per process;
+# holds the load error instead when the model isn't available
+_vad_cache = None
+
+# Length of audio handed to the VAD at once
+VAD_BLOCK_SECONDS = 600
+
+def _park(pipe):
+    """Move the pipeline's model off the GPU until the next job."""
+    park_modules(pipe.model)
+
+def _unpark(pipe):
+    """Move the pipeline's model back onto its device."""
+    unpark_modules(pipe.device, pipe.model)
 
 def load_whisper_pipeline(model_name: str = "base"):
+    """Load whisper model using transformers pipeline, with caching."""
+    if model_name in _pipeline_cache:
+        print(f"✓ Using cached Whisper pipeline: {model_name}")
+        return _pipeline_cache[model_name]
+    
+    pipe = _load_whisper_pipeline(model_name)
+    _pipeline_cache[model_name] = pipe
+    return pipe
+
+def _load_whisper_pipeline(model_name: str = "base"):
     """Load whisper model using transformers pipeline."""
     # Map model names to HuggingFace model IDs
     model_mapping = {
@@ -110,18 +141,10 @@ def transcribe_audio_transformers(audio_path: str, model_name: str = "base") ->
     
     print(f"Transcribing audio file: {audio_path}")
     
+    _unpark(pipe)
     try:
-        # Load audio using torchaudio (transformers expects 16kHz)
-        audio, sr = torchaudio.load(audio_path)
-        
-        # Resample to 16kHz if needed
-        if sr != 16000:
-            resampler = torchaudio.transforms.Resample(sr, 16000)
-            audio = resampler(audio)
-            sr = 16000
-        
-        # Convert to numpy array for transformers
-        audio = audio.squeeze().numpy()
+        # Load audio as 16kHz numpy array (transformers expects 16kHz)
+        audio, sr = load_audio(audio_path)
         
         # Transcribe with timestamps
         result = pipe(audio, return_timestamps=True, generate_kwargs={"language": "english"})
@@ -160,13 +183,156 @@ def transcribe_audio_transformers(audio_path: str, model_name: str = "base") ->
     except Exception as e:
         print(f"Transcription failed: {e}")
         raise RuntimeError(f"Transcription failed: {e}")
+    finally:
+        _park(pipe)
+
+def map_audio(audio_path: str):
+    """Return 16kHz mono samples, memory-mapped as int16 when the file allows it.
+    
+    Use to_float32 on the returned samples (or slices of them) before inference.
+    """
+    # Fast path: the normalized 16kHz mono WAV is mapped without decoding
+    if audio_path.endswith(".wav"):
+        mapped = map_wav_pcm16(audio_path)
+        if mapped is not None:
+            samples, sample_rate, channels = mapped
+            if sample_rate == 16000 and channels == 1:
+                return samples, sample_rate
+        
+        info = sf.info(audio_path)
+        if info.samplerate == 16000 and info.channels == 1:
+            audio, sr = sf.read(audio_path, dtype="float32")
+            return audio, sr
+    
+    audio, sr = torchaudio.load(audio_path)
+    
+    # Resample to 16kHz if needed
+    if sr != 16000:
+        resampler = torchaudio.transforms.Resample(sr, 16000)
+        audio = resampler(audio)
+        sr = 16000
+    
+    return audio.squeeze().numpy(), sr
+
+def to_float32(samples):
+    """Convert int16 PCM samples to float32 in [-1, 1); float input is returned as is."""
+    if samples.dtype != np.int16:
+        return samples
+    audio = samples.astype(np.float32)
+    audio *= 1.0 / 32768.0
+    return audio
+
+def load_audio(audio_path: str):
+    """Load audio as a 16kHz float32 numpy array."""
+    samples, sr = map_audio(audio_path)
+    return to_float32(samples), sr
+
+def load_vad_model():
+    """Load the Silero VAD model bundled with the silero-vad package, with caching.
+    
+    A failed load is cached too, so later jobs go straight to fixed windows
+    instead of retrying it.
+    """
+    global _vad_cache
+    
+    if _vad_cache is None:
+        print("Loading Silero VAD model...")
+        try:
+            from silero_vad import load_silero_vad, get_speech_timestamps
+            _vad_cache = (load_silero_vad(), get_speech_timestamps)
+        except Exception as e:
+            _vad_cache = e
+    if isinstance(_vad_cache, Exception):
+        raise RuntimeError(f"Silero VAD unavailable: {_vad_cache}")
+    return _vad_cache
+
+def get_speech_chunks(audio, sr: int, chunk_duration: int) -> List[Tuple[int, int]]:
+    """Group voiced regions into chunks of at most chunk_duration, cut on silence.
+    
+    Returns (start_sample, end_sample) bounds; silence between chunks is dropped.
+    """
+    model, get_speech_timestamps = load_vad_model()
+    
+    # Run VAD over blocks so int16 input is only converted a block at a time
+    block_samples = VAD_BLOCK_SECONDS * sr
+    speech = []
+    for block_start in range(0, len(audio), block_samples):
+        block = to_float32(audio[block_start:block_start + block_samples])
+        for ts in get_speech_timestamps(torch.from_numpy(np.ascontiguousarray(block)), model, sampling_rate=sr):
+            speech.append({"start": ts["start"] + block_start, "end": ts["end"] + block_start})
+    
+    max_samples = chunk_duration * sr
+    spans = []
+    for ts in speech:
+        if spans and ts["end"] - spans[-1][0] <= max_samples:
+            spans[-1][1] = ts["end"]
+        else:
+            spans.append([ts["start"], ts["end"]])
+    
+    # Voiced regions longer than a chunk are split into fixed windows
+    chunks = []
+    for start, end in spans:
+        for i in range(start, end, max_samples):
+            chunks.append((i, min(i + max_samples, end)))
+    return chunks
+
+def generate_batch(pipe, chunks: List[np.ndarray]) -> List[Dict[str, Any]]:
+    """Transcribe up to 30s chunks with one batched encoder pass and generate call.
+    
+    Results mirror the pipeline output: {"text", "chunks": [{"text", "timestamp"}]}.
+    """
+    features = pipe.feature_extractor(chunks, sampling_rate=16000, return_tensors="pt").input_features
+    features = features.to(pipe.device, dtype=pipe.model.dtype)
+    
+    with torch.inference_mode():
+        token_ids = pipe.model.generate(
+            features,
+            language="english",
+            task="transcribe",
+            return_timestamps=True
+        )
+    
+    results = []
+    for decoded in pipe.tokenizer.batch_decode(token_ids, skip_special_tokens=True, output_offsets=True):
+        results.append({
+            "text": decoded["text"],
+            "chunks": [
+                {"text": offset["text"], "timestamp": offset["timestamp"]}
+                for offset in decoded.get("offsets", [])
+            ]
+        })
+    return results
+
+def generate_chunks(pipe, chunks: List[np.ndarray]) -> List[Dict[str, Any]]:
+    """Run generate_batch, retrying chunk by chunk if the batch fails.
+    
+    A chunk that fails on its own gets an empty result, so one bad chunk only
+    drops its own text.
+    """
+    try:
+        return generate_batch(pipe, chunks)
+    except Exception as e:
+        print(f"Batch of {len(chunks)} chunks failed, retrying individually: {e}")
+    
+    results = []
+    for chunk in chunks:
+        try:
+            results.extend(generate_batch(pipe, [chunk]))
+        except Exception as e:
+            print(f"Failed to process chunk: {e}")
+            results.append({"text": "", "chunks": []})
+    return results
 
 def transcribe_with_simple_chunking(audio_path: str, model_name: str = "base", chunk_duration: int = 30) -> Dict[str, Any]:
     """Transcribe long audio files by simple chunking."""
     
-    # Get audio duration using torchaudio
-    info = torchaudio.info(audio_path)
-    duration = info.num_frames / info.sample_rate
+    # Get audio duration from the header; torchaudio only for formats libsndfile can't read
+    try:
+        info = sf.info(audio_path)
+        duration = info.frames / info.samplerate
+    except RuntimeError:
+        info = torchaudio.info(audio_path)
+        duration = info.num_frames / info.sample_rate
     
     if duration <= chunk_duration * 2:
         # Short file, transcribe directly
@@ -177,69 +343,70 @@ def transcribe_with_simple_chunking(audio_path: str, model_name: str = "base", c
     # Long file, use chunking
     pipe = load_whisper_pipeline(model_name)
     
-    # Load audio using torchaudio
-    audio, sr = torchaudio.load(audio_path)
+    # Map audio as 16kHz samples; chunks are converted to float as they are decoded
+    audio, sr = map_audio(audio_path)
     
-    # Resample to 16kHz if needed
-    if sr != 16000:
-        resampler = torchaudio.transforms.Resample(sr, 16000)
-        audio = resampler(audio)
-        sr = 16000
-    
-    # Convert to numpy for processing
-    audio = audio.squeeze().numpy()
-    
-    # Calculate chunks
-    chunk_samples = chunk_duration * sr
+    # Only decode voiced chunks; fall back to fixed windows if VAD is unavailable
+    try:
+        bounds = get_speech_chunks(audio, sr, chunk_duration)
+        print(f"VAD found {len(bounds)} voiced chunks")
+    except Exception as e:
+        print(f"VAD failed, using fixed {chunk_duration}s windows: {e}")
+        chunk_samples = chunk_duration * sr
+        bounds = [(i, min(i + chunk_samples, len(audio))) for i in range(0, len(audio), chunk_samples)]
     
     segments_list = []
-    current_time = 0
     
-    for i in range(0, len(audio), chunk_samples):
-        chunk_start = i
-        chunk_end = min(i + chunk_samples, len(audio))
-        
-        # Extract chunk
-        chunk = audio[chunk_start:chunk_end]
-        chunk_duration_actual = len(chunk) / sr
-        
-        print(f"Processing chunk {i//chunk_samples + 1}: {current_time:.1f}s - {current_time + chunk_duration_actual:.1f}s")
-        
+    if bounds:
+        _unpark(pipe)
         try:
-            # Transcribe chunk
-            result = pipe(chunk, return_timestamps=True, generate_kwargs={"language": "english"})
+            results = []
+            for i in range(0, len(bounds), 16):
+                results.extend(generate_chunks(
+                    pipe,
+                    [to_float32(audio[start:end]) for start, end in bounds[i:i + 16]]
+                ))
+        except Exception as e:
+            print(f"Chunked transcription failed: {e}")
+            raise RuntimeError(f"Transcription failed: {e}")
+        finally:
+            _park(pipe)
+        
+        # Collect chunk-relative timestamps, then shift them all by their chunk offset
+        chunk_ids, starts, ends, texts = [], [], [], []
+        for i, ((start, end), result) in enumerate(zip(bounds, results)):
+            chunk_duration_actual = (end - start) / sr
             
-            # Add to results with adjusted timestamps
             if 'chunks' in result and result['chunks']:
                 for chunk_data in result['chunks']:
-                    segment_dict = {
-                        "start": (chunk_data['timestamp'][0] or 0.0) + current_time,
-                        "end": (chunk_data['timestamp'][1] or chunk_duration_actual) + current_time,
-                        "text": chunk_data['text'].strip(),
-                        "words": []
-                    }
-                    if segment_dict["text"]:  # Only add non-empty segments
-                        segments_list.append(segment_dict)
+                    chunk_ids.append(i)
+                    starts.append(chunk_data['timestamp'][0] or 0.0)
+                    ends.append(chunk_data['timestamp'][1] or chunk_duration_actual)
+                    texts.append(chunk_data['text'].strip())
             else:
                 # Fallback: single segment for chunk
-                if result['text'].strip():
-                    segments_list.append({
-                        "start": current_time,
-                        "end": current_time + chunk_duration_actual,
-                        "text": result['text'].strip(),
-                        "words": []
-                    })
-            
-            current_time += chunk_duration_actual
-            
-        except Exception as e:
-            print(f"Failed to process chunk {i//chunk_samples + 1}: {e}")
-            # Continue with next chunk
-            current_time += chunk_duration_actual
-            continue
+                chunk_ids.append(i)
+                starts.append(0.0)
+                ends.append(chunk_duration_actual)
+                texts.append(result['text'].strip())
+        
+        offsets = np.array([start for start, _ in bounds], dtype=np.float64) / sr
+        chunk_offsets = offsets[np.array(chunk_ids, dtype=np.int64)]
+        starts = (np.array(starts, dtype=np.float64) + chunk_offsets).tolist()
+        ends = (np.array(ends, dtype=np.float64) + chunk_offsets).tolist()
+        
+        # Only add non-empty segments
+        for start, end, text in zip(starts, ends, texts):
+            if text.strip():
+                segments_list.append({
+                    "start": start,
+                    "end": end,
+                    "text": text,
+                    "words": []
+                })
     
     # Combine all text
-    full_text = " ".join([seg["text"] for seg in segments_list])
+    full_text = " ".join(seg["text"] for seg in segments_list)
     
     return {
         "segments": segments_list,
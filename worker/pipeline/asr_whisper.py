@@ -8,6 +8,7 @@ import torch
 import whisper
 from typing import Dict, Any, List
 from pathlib import Path
+from pipeline.gpu_mutex import release_gpu_memory
 
 def transcribe_audio(audio_path: str, model_name: str = "base", compute_type: str = "float32") -> Dict[str, Any]:
     """
@@ -29,14 +30,18 @@ def transcribe_audio(audio_path: str, model_name: str = "base", compute_type: st
     
     print(f"Transcribing audio file: {audio_path}")
     
-    # Transcribe with word timestamps
-    result = model.transcribe(
-        audio_path,
-        word_timestamps=True,
-        verbose=True,
-        language=None,  # Auto-detect language
-        task="transcribe"
-    )
+    # Transcribe with word timestamps, then free the model's GPU memory for the next stage
+    try:
+        result = model.transcribe(
+            audio_path,
+            word_timestamps=True,
+            verbose=True,
+            language=None,  # Auto-detect language
+            task="transcribe"
+        )
+    finally:
+        del model
+        release_gpu_memory()
     
     # Format segments for compatibility with the rest of the pipeline
     segments = []
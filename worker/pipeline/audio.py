@@ -3,10 +3,36 @@ Audio processing utilities using ffmpeg
 """
 
 import os
+import struct
+import shutil
 import subprocess
 import json
+import threading
+import librosa
+import numpy as np
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple, List
+
+def _available_cpus() -> List[int]:
+    """Return the CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+# Threads given to ffmpeg so loudnorm/encoding doesn't starve the Python decoder
+FFMPEG_THREADS = int(os.getenv("FFMPEG_THREADS", str(max(1, len(_available_cpus()) // 2))))
+
+# Pins ffmpeg to the last FFMPEG_THREADS CPUs. taskset sets the affinity before ffmpeg
+# starts, without a preexec_fn, which isn't safe to run from this threaded process.
+_FFMPEG_TASKSET = (
+    ["taskset", "-c", ",".join(str(cpu) for cpu in _available_cpus()[-FFMPEG_THREADS:])]
+    if shutil.which("taskset") else []
+)
+
+def run_ffmpeg(cmd: List[str]) -> subprocess.CompletedProcess:
+    """Run an ffmpeg command with a bounded thread count and CPU set."""
+    cmd = _FFMPEG_TASKSET + cmd[:-1] + ["-threads", str(FFMPEG_THREADS), cmd[-1]]
+    return subprocess.run(cmd, capture_output=True, text=True)
 
 def get_audio_info(file_path: str) -> Dict[str, Any]:
     """Get audio file information using ffprobe."""
@@ -39,6 +65,80 @@ def get_audio_info(file_path: str) -> Dict[str, Any]:
         "bit_rate": int(audio_stream.get("bit_rate", 0))
     }
 
+def map_wav_pcm16(file_path: str) -> Optional[Tuple[np.memmap, int, int]]:
+    """Memory-map the sample data of a 16-bit PCM WAV file.
+    
+    Returns (samples, sample_rate, channels) with interleaved int16 samples,
+    or None if the file is not a plain 16-bit PCM WAV.
+    """
+    fmt = None
+    with open(file_path, "rb") as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            return None
+        
+        # Walk the chunks until the sample data
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return None
+            chunk_id = header[:4]
+            chunk_size = struct.unpack("<I", header[4:])[0]
+            if chunk_id == b"data":
+                data_offset = f.tell()
+                break
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_size)
+                f.seek(chunk_size & 1, 1)
+            else:
+                f.seek(chunk_size + (chunk_size & 1), 1)
+    
+    if fmt is None or len(fmt) < 16:
+        return None
+    
+    audio_format, channels, sample_rate = struct.unpack("<HHI", fmt[:8])
+    bits_per_sample = struct.unpack("<H", fmt[14:16])[0]
+    if audio_format != 1 or bits_per_sample != 16 or channels == 0:
+        return None
+    
+    # Streamed WAVs may leave the data size unset, so trust the file size
+    available = os.path.getsize(file_path) - data_offset
+    data_size = min(chunk_size, available) if chunk_size else available
+    frames = data_size // (2 * channels)
+    if frames == 0:
+        return None
+    
+    samples = np.memmap(file_path, dtype="<i2", mode="r", offset=data_offset, shape=(frames * channels,))
+    return samples, sample_rate, channels
+
+# Decoded samples of the file the current job is working on, shared by every
+# stage that needs them (alignment, diarization, speaker embeddings)
+_decoded_audio_cache = {"key": None, "audio": None}
+_decoded_audio_lock = threading.Lock()
+
+def load_audio_16k(file_path: str) -> np.ndarray:
+    """Return the file as 16kHz mono float32, decoding it only once per file version."""
+    key = (file_path, os.path.getmtime(file_path))
+    with _decoded_audio_lock:
+        if _decoded_audio_cache["key"] == key:
+            return _decoded_audio_cache["audio"]
+        
+        mapped = map_wav_pcm16(file_path)
+        if mapped is not None and mapped[1] == 16000 and mapped[2] == 1:
+            audio = mapped[0].astype(np.float32)
+            audio *= 1.0 / 32768.0
+        else:
+            audio, _ = librosa.load(file_path, sr=16000, mono=True)
+        
+        # Stages share this array, so they must not modify it in place
+        _decoded_audio_cache.update(key=key, audio=audio)
+        return audio
+
+def clear_audio_cache():
+    """Drop the decoded samples once a job is done with them."""
+    with _decoded_audio_lock:
+        _decoded_audio_cache.update(key=None, audio=None)
+
 def normalize_audio(input_path: str, output_path: str) -> Dict[str, Any]:
     """Normalize audio to EBU R128 standards and convert to 16kHz mono WAV."""
     cmd = [
@@ -48,7 +148,7 @@ def normalize_audio(input_path: str, output_path: str) -> Dict[str, Any]:
         output_path
     ]
     
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = run_ffmpeg(cmd)
     if result.returncode != 0:
         raise RuntimeError(f"ffmpeg normalization failed: {result.stderr}")
     
@@ -74,7 +174,7 @@ def create_opus_archive(input_path: str, job_id: str) -> str:
         archive_path
     ]
     
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = run_ffmpeg(cmd)
     if result.returncode != 0:
         raise RuntimeError(f"ffmpeg opus archive failed: {result.stderr}")
     
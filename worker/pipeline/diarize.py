@@ -4,21 +4,93 @@ Speaker diarization using pyannote.audio with local model caching
 
 import os
 import json
+import hashlib
+import tempfile
+import threading
+import numpy as np
+import torch
+from numba import njit, prange
 from typing import Dict, Any, List, Optional
-from pyannote.audio import Pipeline
+from pyannote.audio import Pipeline, __version__ as pyannote_version
 from pipeline.artifacts import log_step, write_json
+from pipeline.audio import load_audio_16k
 
-# Global pipeline cache to avoid reloading
-_pipeline_cache = None
+# Global pipeline cache keyed by HF token hash to avoid reloading
+_pipeline_cache: Dict[str, Pipeline] = {}
+_pipeline_lock = threading.Lock()
+
+# Pretrained pipeline and revision loaded from the Hugging Face hub
+DIARIZATION_MODEL = "pyannote/speaker-diarization@2.1"
+
+# Pickled pipelines written after the first load. torch.load runs arbitrary
+# code from these files, so only files this user wrote (and no one else can
+# modify) are loaded.
+FROZEN_PIPELINE_DIR = "/app/model_cache"
+
+def _frozen_pipeline_path(cache_key: str) -> str:
+    """Pickle path keyed by model revision, pyannote version and HF token hash."""
+    model = DIARIZATION_MODEL.replace("/", "_").replace("@", "-")
+    return os.path.join(FROZEN_PIPELINE_DIR, f"{model}_{pyannote_version}_{cache_key}.pt")
+
+def _load_frozen_pipeline(cache_key: str) -> Optional[Pipeline]:
+    """Load the pickled pipeline if a trusted one exists for this key."""
+    path = _frozen_pipeline_path(cache_key)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        print(f"Warning: Ignoring frozen pipeline {path}: not owned by this user or writable by others")
+        return None
+    try:
+        return torch.load(path, map_location="cpu", weights_only=False)
+    except Exception as e:
+        print(f"Frozen pipeline load failed: {e}")
+        return None
+
+def _freeze_pipeline(pipeline: Pipeline, cache_key: str):
+    """Pickle the pipeline so later cold starts skip from_pretrained."""
+    path = _frozen_pipeline_path(cache_key)
+    try:
+        # mkstemp creates the file 0600; the rename makes it appear complete or not at all
+        fd, tmp_path = tempfile.mkstemp(dir=FROZEN_PIPELINE_DIR, suffix=".pt.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                torch.save(pipeline, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        print(f"✓ Saved frozen diarization pipeline to {path}")
+    except Exception as e:
+        print(f"Failed to save frozen diarization pipeline: {e}")
 
 def load_diarization_pipeline(hf_token: str) -> Pipeline:
     """Load pyannote.audio diarization pipeline with caching."""
-    global _pipeline_cache
+    cache_key = hashlib.sha256(hf_token.encode()).hexdigest()[:16]
     
     # Return cached pipeline if available
-    if _pipeline_cache is not None:
+    pipeline = _pipeline_cache.get(cache_key)
+    if pipeline is not None:
         print("✓ Using cached diarization pipeline")
-        return _pipeline_cache
+        return pipeline
+    
+    # Only one thread loads; others wait and reuse its pipeline
+    with _pipeline_lock:
+        pipeline = _pipeline_cache.get(cache_key)
+        if pipeline is None:
+            pipeline = _load_diarization_pipeline(hf_token, cache_key)
+            _pipeline_cache[cache_key] = pipeline
+        else:
+            print("✓ Using cached diarization pipeline")
+        return pipeline
+
+def _load_diarization_pipeline(hf_token: str, cache_key: str) -> Pipeline:
+    """Load pyannote.audio diarization pipeline."""
+    pipeline = _load_frozen_pipeline(cache_key)
+    if pipeline is not None:
+        print("✓ Loaded frozen diarization pipeline")
+        return pipeline
     
     print(f"Loading diarization pipeline with HF token: {hf_token[:10]}...")
     
@@ -33,12 +105,12 @@ def load_diarization_pipeline(hf_token: str) -> Pipeline:
         try:
             print("Attempting to load pipeline from local cache...")
             pipeline = Pipeline.from_pretrained(
-                "pyannote/speaker-diarization@2.1",
+                DIARIZATION_MODEL,
                 cache_dir=cache_dir,
                 local_files_only=True
             )
             print("✓ Loaded diarization pipeline from local cache")
-            _pipeline_cache = pipeline
+            _freeze_pipeline(pipeline, cache_key)
             return pipeline
         except Exception as cache_error:
             print(f"Cache load failed: {cache_error}")
@@ -46,7 +118,7 @@ def load_diarization_pipeline(hf_token: str) -> Pipeline:
         
         # Download with token if cache fails
         pipeline = Pipeline.from_pretrained(
-            "pyannote/speaker-diarization@2.1",
+            DIARIZATION_MODEL,
             use_auth_token=hf_token,
             cache_dir=cache_dir
         )
@@ -61,7 +133,7 @@ def load_diarization_pipeline(hf_token: str) -> Pipeline:
             )
         
         print("✓ Diarization pipeline downloaded and cached successfully")
-        _pipeline_cache = pipeline
+        _freeze_pipeline(pipeline, cache_key)
         return pipeline
     
     except Exception as e:
@@ -84,7 +156,8 @@ def diarize_audio(audio_path: str, hf_token: str) -> Dict[str, Any]:
     pipeline = load_diarization_pipeline(hf_token)
     
     # Run diarization
-    diarization = pipeline(audio_path)
+    waveform = torch.from_numpy(load_audio_16k(audio_path)).unsqueeze(0)
+    diarization = pipeline({"waveform": waveform, "sample_rate": 16000})
     
     # Extract speaker turns
     turns = []
@@ -100,61 +173,96 @@ def diarize_audio(audio_path: str, hf_token: str) -> Dict[str, Any]:
         "speakers": list(set(turn["speaker"] for turn in turns))
     }
 
-def map_words_to_speakers(aligned_words: List[Dict[str, Any]], diarization_result: Dict[str, Any]) -> List[Dict[str, Any]]:
-    """Map aligned words to speakers based on diarization turns."""
-    turns = diarization_result["turns"]
-    
-    # Create a mapping of time ranges to speakers
-    speaker_map = {}
-    for turn in turns:
-        for time in range(int(turn["start"] * 100), int(turn["end"] * 100)):
-            speaker_map[time / 100] = turn["speaker"]
-    
-    # Map each word to a speaker
-    for word in aligned_words:
-        word_start = word["start"]
-        word_end = word["end"]
+@njit(parallel=True, cache=True)
+def _find_turns(mids, starts, max_ends):
+    """Return the index of the first turn containing each word midpoint, or -1.
+    
+    Turns must be sorted by start; max_ends is the running maximum of turn ends.
+    """
+    out = np.empty(mids.size, np.int32)
+    for i in prange(mids.size):
+        mid = mids[i]
         
-        # Find the speaker for the middle of the word
-        word_middle = (word_start + word_end) / 2
+        # Turns starting at or before the midpoint are [0, limit)
+        lo, hi = 0, starts.size
+        while lo < hi:
+            m = (lo + hi) // 2
+            if starts[m] <= mid:
+                lo = m + 1
+            else:
+                hi = m
+        limit = lo
         
-        # Find overlapping turn
-        speaker = "Unknown"
-        for turn in turns:
-            if turn["start"] <= word_middle <= turn["end"]:
-                speaker = turn["speaker"]
-                break
+        # The first turn whose running max end reaches the midpoint contains it
+        lo, hi = 0, limit
+        while lo < hi:
+            m = (lo + hi) // 2
+            if max_ends[m] >= mid:
+                hi = m
+            else:
+                lo = m + 1
         
-        word["speaker"] = speaker
+        out[i] = lo if lo < limit else -1
+    return out
+
+@njit(cache=True)
+def _majority_votes(segment_ids, speaker_ids, n_segments, n_speakers):
+    """Return the most common speaker index per segment, or -1 if it has no words.
+    
+    Ties go to the speaker whose first word in the segment comes earliest.
+    """
+    counts = np.zeros((n_segments, n_speakers), np.int64)
+    first_seen = np.full((n_segments, n_speakers), segment_ids.size, np.int64)
+    for i in range(segment_ids.size):
+        seg = segment_ids[i]
+        if seg < 0 or seg >= n_segments:
+            continue
+        spk = speaker_ids[i]
+        counts[seg, spk] += 1
+        if first_seen[seg, spk] > i:
+            first_seen[seg, spk] = i
+    
+    out = np.full(n_segments, -1, np.int32)
+    for seg in range(n_segments):
+        best = -1
+        for spk in range(n_speakers):
+            if counts[seg, spk] == 0:
+                continue
+            if (best == -1 or counts[seg, spk] > counts[seg, best]
+                    or (counts[seg, spk] == counts[seg, best] and first_seen[seg, spk] < first_seen[seg, best])):
+                best = spk
+        out[seg] = best
+    return out
+
+def map_words_to_speakers(aligned_words: List[Dict[str, Any]], diarization_result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Map aligned words to speakers based on diarization turns."""
+    turns = sorted(diarization_result["turns"], key=lambda turn: turn["start"])
+    
+    starts = np.array([turn["start"] for turn in turns], dtype=np.float64)
+    max_ends = np.maximum.accumulate(np.array([turn["end"] for turn in turns], dtype=np.float64))
+    
+    # Find the speaker for the middle of each word
+    mids = np.array([(word["start"] + word["end"]) / 2 for word in aligned_words], dtype=np.float64)
+    turn_idx = _find_turns(mids, starts, max_ends)
+    
+    for word, idx in zip(aligned_words, turn_idx):
+        word["speaker"] = turns[idx]["speaker"] if idx >= 0 else "Unknown"
     
     return aligned_words
 
 def assign_speakers_to_segments(segments: List[Dict[str, Any]], word_speakers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """Assign speakers to segments based on majority vote of words."""
-    # Group words by segment
-    segment_words = {}
-    for word in word_speakers:
-        segment_id = word.get("segment_id", 0)
-        if segment_id not in segment_words:
-            segment_words[segment_id] = []
-        segment_words[segment_id].append(word)
-    
-    # Assign speaker to each segment by majority vote
-    for i, segment in enumerate(segments):
-        if i in segment_words:
-            words = segment_words[i]
-            speaker_counts = {}
-            
-            for word in words:
-                speaker = word.get("speaker", "Unknown")
-                speaker_counts[speaker] = speaker_counts.get(speaker, 0) + 1
-            
-            # Find most common speaker
-            if speaker_counts:
-                segment["speaker"] = max(speaker_counts, key=speaker_counts.get)
-            else:
-                segment["speaker"] = "Unknown"
-        else:
-            segment["speaker"] = "Unknown"
+    labels = {}
+    speaker_ids = np.array(
+        [labels.setdefault(word.get("speaker", "Unknown"), len(labels)) for word in word_speakers],
+        dtype=np.int64
+    )
+    segment_ids = np.array([word.get("segment_id", 0) for word in word_speakers], dtype=np.int64)
+    
+    winners = _majority_votes(segment_ids, speaker_ids, len(segments), len(labels))
+    
+    names = list(labels)
+    for segment, winner in zip(segments, winners):
+        segment["speaker"] = names[winner] if winner >= 0 else "Unknown"
     
     return segments 
\ No newline at end of file
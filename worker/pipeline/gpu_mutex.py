@@ -3,34 +3,121 @@ GPU mutex for coordinating GPU operations
 """
 
 import os
-import time
+import threading
 from redis import Redis
-from dotenv import load_dotenv
+from redis.exceptions import LockError, RedisError
+from redis_pool import create_redis_pool
 
-load_dotenv()
+if os.getenv("SKIP_DOTENV") != "1":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# Number of GPU slots shared by the models this worker keeps resident. With a
+# single slot, models are parked on the CPU between uses so only one of them
+# occupies GPU memory at a time.
+GPU_POOL_SIZE = int(os.getenv("GPU_POOL_SIZE", "1"))
+
+# Shared by every GPUMutex so taking the lock doesn't open a new connection pool
+_redis_pool = create_redis_pool(os.getenv("REDIS_URL", "redis://redis:6379/0"))
+
+# Seconds the GPU lock survives without renewal. The holder renews it every third
+# of that, so a long ASR run keeps it while a crashed worker's lock soon expires.
+GPU_LOCK_TTL = int(os.getenv("GPU_LOCK_TTL", "60"))
 
 class GPUMutex:
-    """Simple mutex for GPU operations using Redis."""
+    """Simple mutex for GPU operations using Redis.
+    
+    With timeout=None, waiting for the GPU has no deadline; jobs on other workers
+    take turns however long each one holds the lock.
+    """
     
-    def __init__(self, lock_name="gpu_lock", timeout=300):
+    def __init__(self, lock_name="gpu_lock", timeout=None):
         self.lock_name = lock_name
         self.timeout = timeout
-        self.redis_url = os.getenv("REDIS_URL", "redis://redis:6379/0")
-        self.redis = Redis.from_url(self.redis_url)
+        self.redis = Redis(connection_pool=_redis_pool)
+        # thread_local=False so the renewal thread can extend the token this thread took
+        self.lock = self.redis.lock(lock_name, timeout=GPU_LOCK_TTL, sleep=1, thread_local=False)
+        self._released = threading.Event()
+        self._renewer = None
+    
+    def _renew(self):
+        """Reset the lock's TTL until it is released."""
+        while not self._released.wait(GPU_LOCK_TTL / 3):
+            try:
+                self.lock.reacquire()
+            except LockError as e:
+                print(f"Warning: Lost GPU lock while holding it: {e}")
+                return
+            except RedisError as e:
+                print(f"Warning: Could not renew GPU lock, retrying: {e}")
     
     def __enter__(self):
         """Acquire the lock."""
-        start_time = time.time()
-        while time.time() - start_time < self.timeout:
-            if self.redis.set(self.lock_name, "locked", ex=300, nx=True):
-                return self
-            time.sleep(1)
-        raise TimeoutError(f"Could not acquire GPU lock after {self.timeout} seconds")
+        if not self.lock.acquire(blocking_timeout=self.timeout):
+            raise TimeoutError(f"Could not acquire GPU lock after {self.timeout} seconds")
+        self._released.clear()
+        self._renewer = threading.Thread(target=self._renew, name="gpu-lock-renew", daemon=True)
+        self._renewer.start()
+        return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
         """Release the lock."""
-        self.redis.delete(self.lock_name)
+        self._released.set()
+        self._renewer.join()
+        try:
+            self.lock.release()
+        except LockError:
+            # Expired and possibly taken by another worker; nothing of ours to release
+            pass
 
 def get_gpu_mutex():
     """Get a GPU mutex instance."""
-    return GPUMutex() 
\ No newline at end of file
+    return GPUMutex()
+
+def park_modules(*modules):
+    """Move models to the CPU and release their cached GPU memory."""
+    if GPU_POOL_SIZE != 1:
+        return
+    
+    import torch
+    if not torch.cuda.is_available():
+        return
+    
+    for module in modules:
+        if module is not None:
+            module.to("cpu")
+    torch.cuda.empty_cache()
+
+def unpark_modules(device, *modules):
+    """Move parked models back onto the device their pipeline runs on."""
+    if GPU_POOL_SIZE != 1:
+        return
+    
+    import torch
+    if not torch.cuda.is_available():
+        return
+    
+    for module in modules:
+        if module is not None:
+            module.to(device)
+
+def release_gpu_memory():
+    """Return the CUDA cache left by models a stage loaded and has dropped."""
+    if GPU_POOL_SIZE != 1:
+        return
+    
+    import torch
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def run_on_stream(fn, *args):
+    """Call fn on its own CUDA stream so it can overlap work on other streams."""
+    import torch
+    if not torch.cuda.is_available():
+        return fn(*args)
+    
+    stream = torch.cuda.Stream()
+    with torch.cuda.stream(stream):
+        result = fn(*args)
+    stream.synchronize()
+    return result
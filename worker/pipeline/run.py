@@ -3,36 +3,27 @@ Main pipeline runner for VoiceStack2
 """
 
 import asyncio
+import functools
+import importlib
 import os
 import json
 import logging
 import traceback
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List
 from pathlib import Path
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 
 # Import worker-specific modules using absolute paths
 from pipeline.artifacts import log_step, write_json, write_text, write_srt, write_vtt
-from pipeline.audio import process_audio_file
+from pipeline.audio import clear_audio_cache, process_audio_file
 
-# Try to use OpenAI Whisper (no ctranslate2), fall back to other options
-try:
-    from pipeline.asr_whisper import transcribe_audio
-    print("✓ Using OpenAI Whisper ASR (ctranslate2 bypassed)")
-except ImportError as e:
-    print(f"OpenAI Whisper import failed: {e}")
-    try:
-        from pipeline.asr import transcribe_audio
-        print("✓ Using faster-whisper ASR")
-    except (ImportError, SyntaxError) as e2:
-        print(f"faster-whisper ASR failed: {e2}")
-        print("Using simple transformers ASR fallback")
-        from pipeline.asr_simple import transcribe_audio
 from pipeline.align import align_with_whisperx
 from pipeline.diarize import diarize_audio, map_words_to_speakers, assign_speakers_to_segments
 from pipeline.speakers import process_speaker_embeddings
-from pipeline.gpu_mutex import get_gpu_mutex
+from pipeline.gpu_mutex import get_gpu_mutex, run_on_stream, GPU_POOL_SIZE
 
 # Import database and models with fallback handling
 try:
@@ -70,30 +61,66 @@ except ImportError:
         COMPLETED = "COMPLETED"
         FAILED = "FAILED"
 
-async def run_job(job_id: str, input_path: str, params: Dict[str, Any]) -> None:
-    """Run the complete pipeline for a job."""
-    # Convert job_id string to UUID
+# ASR backend modules by name, imported on first use; order is the fallback order
+_ASR_BACKENDS = {
+    "openai": "pipeline.asr_whisper",  # OpenAI Whisper (no ctranslate2)
+    "faster_whisper": "pipeline.asr",
+    "transformers": "pipeline.asr_simple",
+}
+
+# Default backend, overridable per deployment via settings model_config["asr_backend"]
+ASR_BACKEND = os.getenv("ASR_BACKEND", "openai")
+
+@functools.lru_cache(maxsize=None)
+def get_transcribe_audio(backend: str):
+    """Import the named ASR backend, falling back to the next one if it can't be imported."""
+    names = list(_ASR_BACKENDS)
+    if backend not in _ASR_BACKENDS:
+        print(f"Warning: Unknown ASR backend '{backend}', using {names[0]}")
+        backend = names[0]
+    
+    for name in names[names.index(backend):]:
+        try:
+            module = importlib.import_module(_ASR_BACKENDS[name])
+            print(f"✓ Using {name} ASR backend")
+            return module.transcribe_audio
+        except (ImportError, SyntaxError) as e:
+            print(f"{name} ASR backend unavailable: {e}")
+    
+    raise RuntimeError(f"No ASR backend available (requested {backend})")
+
+def _update_job(job_uuid: uuid.UUID, **values) -> bool:
+    """Set job columns in a short transaction of their own."""
+    if Job is None:
+        return False
     try:
-        job_uuid = uuid.UUID(job_id)
-    except ValueError:
-        raise RuntimeError(f"Invalid job ID format: {job_id}")
+        with next(get_db()) as db:
+            rowcount = db.execute(update(Job).where(Job.id == job_uuid).values(**values)).rowcount
+            db.commit()
+        return rowcount > 0
+    except Exception as e:
+        print(f"Warning: Failed to update job: {e}")
+        return False
+
+def _update_progress(state: Dict[str, Any], progress: int) -> None:
+    """Publish job progress; only done before long steps so the UI sees it while they run."""
+    if state["job_found"]:
+        _update_job(state["job_uuid"], progress=progress)
+
+def _load_job_state(job_id: str, job_uuid: uuid.UUID) -> Dict[str, Any]:
+    """Mark the job running and load settings, returning the state the pipeline needs."""
+    job_found = False
+    settings_dict = {}
     
-    # Get database session with error handling
     try:
         db = next(get_db())
         if db is None:
             raise RuntimeError("Failed to get database session")
-        print(f"✓ Got database session: {db}")
     except Exception as e:
         print(f"Database connection failed: {e}")
         raise RuntimeError(f"Database connection failed: {e}")
     
-    job = None  # Declare job variable outside try block
-    
-    try:
-        # Step 0: Setup
-        log_step(job_id, "Starting pipeline")
-        
+    with db:
         # Update job status - with better error handling
         if Job is not None:
             try:
@@ -104,15 +131,14 @@ async def run_job(job_id: str, input_path: str, params: Dict[str, Any]) -> None:
                     job.status = JobStatus.RUNNING.value
                     job.progress = 0
                     db.commit()
+                    job_found = True
                     print(f"✓ Updated job status to RUNNING")
             except Exception as e:
                 print(f"Warning: Failed to update job status: {e}")
-                job = None
         else:
             print("Warning: Job model not available, skipping database updates")
         
         # Get settings with fallback
-        settings_dict = {}
         try:
             if 'Setting' in globals() and Setting is not None:
                 settings = db.query(Setting).filter(Setting.id == 1).first()
@@ -129,323 +155,393 @@ async def run_job(job_id: str, input_path: str, params: Dict[str, Any]) -> None:
                 print("Warning: Setting model not available, using defaults")
         except Exception as e:
             print(f"Warning: Failed to load settings: {e}")
-        
-        # Set default settings if none loaded
-        if not settings_dict:
-            settings_dict = {
-                "model_config": {
-                    "whisper_model": os.getenv("WHISPER_MODEL", "base"),
-                    "whisper_compute_type": "float32"  # CPU compatible
-                },
-                "secrets_config": {},
-                "hf_token": os.getenv("HF_TOKEN")
-            }
-            print("✓ Using environment variable settings")
-        
-        # Step 1: Audio processing
-        log_step(job_id, "Processing audio file")
-        audio_result = process_audio_file(input_path, job_id)
-        
-        # Update asset with metadata
-        asset = None  # Initialize asset variable
-        print(f"DEBUG: Asset model status: {Asset}, Job model status: {job}")
-        if Asset is not None and job is not None:
-            try:
-                asset = db.query(Asset).filter(Asset.job_id == job_uuid).first()
+    
+    # Set default settings if none loaded
+    if not settings_dict:
+        settings_dict = {
+            "model_config": {
+                "whisper_model": os.getenv("WHISPER_MODEL", "base"),
+                "whisper_compute_type": "float32"  # CPU compatible
+            },
+            "secrets_config": {},
+            "hf_token": os.getenv("HF_TOKEN")
+        }
+        print("✓ Using environment variable settings")
+    
+    return {"job_id": job_id, "job_uuid": job_uuid, "job_found": job_found, "settings": settings_dict}
+
+def _save_asset_metadata(state: Dict[str, Any], audio_result: Dict[str, Any]):
+    """Store audio metadata on the job's asset and publish progress, returning the asset ID."""
+    asset_id = None
+    print(f"DEBUG: Asset model status: {Asset}, Job found: {state['job_found']}")
+    if Asset is not None and state["job_found"]:
+        try:
+            with next(get_db()) as db:
+                asset = db.query(Asset).filter(Asset.job_id == state["job_uuid"]).first()
                 if asset:
                     asset.duration = audio_result["duration"]
                     asset.samplerate = audio_result["sample_rate"]
                     asset.channels = audio_result["channels"]
                     asset.archival_path = audio_result["archive_path"]
+                    asset_id = asset.id
+                    db.execute(update(Job).where(Job.id == state["job_uuid"]).values(progress=10))
                     db.commit()
                     print("✓ Updated asset metadata")
-                else:
-                    print("Warning: Asset not found for job")
-            except Exception as e:
-                print(f"Warning: Failed to update asset: {e}")
-                asset = None
-        else:
-            print("Warning: Asset model or job not available, skipping asset updates")
-        
-        if job:
-            try:
-                job.progress = 10
-                db.commit()
-            except Exception as e:
-                print(f"Warning: Failed to update job progress: {e}")
-        
-        # Step 2: ASR
-        log_step(job_id, "Running ASR")
-        
-        with get_gpu_mutex():
-            whisper_model = settings_dict["model_config"].get("whisper_model", "base")
-            # Use float32 for CPU compatibility, float16 only for GPU
-            compute_type = "float32"  # Changed from float16 to float32 for CPU compatibility
-            
-            asr_result = transcribe_audio(
-                audio_result["normalized_path"],
-                whisper_model,
-                compute_type
+                    return asset_id
+                print("Warning: Asset not found for job")
+        except Exception as e:
+            print(f"Warning: Failed to update asset: {e}")
+    else:
+        print("Warning: Asset model or job not available, skipping asset updates")
+    
+    _update_progress(state, 10)
+    return asset_id
+
+def _embed_speakers(audio_path: str, diarization_result: Dict[str, Any]) -> Dict[str, Any]:
+    """Match speakers under the GPU mutex; the session only connects after ECAPA inference."""
+    with get_gpu_mutex(), next(get_db()) as db:
+        return process_speaker_embeddings(audio_path, diarization_result, db)
+
+def _persist_results(state: Dict[str, Any], asset_id, segments: List[Dict[str, Any]], speaker_mapping: Dict[str, Any], transcript_text: str):
+    """Save the transcript and its segments in one transaction, returning the transcript ID."""
+    with next(get_db()) as db:
+        transcript = db.query(Transcript).filter(Transcript.asset_id == asset_id).first()
+        if not transcript:
+            transcript = Transcript(
+                asset_id=asset_id,
+                raw_text=transcript_text
             )
-        
-        write_json(job_id, "asr_segments.json", asr_result)
-        
-        if job:
-            try:
-                job.progress = 40
-                db.commit()
-            except Exception as e:
-                print(f"Warning: Failed to update job progress: {e}")
-        
-        # Step 3: Alignment
-        log_step(job_id, "Running word-level alignment")
-        
-        with get_gpu_mutex():
-            alignment_result = align_with_whisperx(
-                audio_result["normalized_path"],
-                asr_result
+            db.add(transcript)
+            db.flush()
+        
+        # Create segments
+        for segment_data in segments:
+            # Find speaker ID
+            speaker_id = None
+            if segment_data.get("speaker") != "Unknown":
+                speaker_label = segment_data["speaker"]
+                if speaker_label in speaker_mapping:
+                    speaker_id = speaker_mapping[speaker_label]
+            
+            segment = Segment(
+                transcript_id=transcript.id,
+                start=segment_data["start"],
+                end=segment_data["end"],
+                text=segment_data["text"],
+                word_timings=segment_data.get("words", []),
+                speaker_id=speaker_id,
+                original_speaker_label=segment_data.get("speaker")
             )
+            db.add(segment)
         
-        write_json(job_id, "aligned_words.json", alignment_result)
+        transcript_id = transcript.id
+        if state["job_found"]:
+            db.execute(update(Job).where(Job.id == state["job_uuid"]).values(progress=90))
+        db.commit()
+        return transcript_id
+
+def _finish_job(state: Dict[str, Any], transcript_id, title: str, summary: str, tags: List[str]) -> None:
+    """Save LLM metadata and mark the job succeeded in one transaction."""
+    job_id = state["job_id"]
+    with next(get_db()) as db:
+        if title or summary or tags:
+            # Update transcript if available
+            if transcript_id is not None:
+                values = {}
+                if title:
+                    values["title"] = title
+                if summary:
+                    values["summary"] = summary
+                if values:
+                    db.execute(update(Transcript).where(Transcript.id == transcript_id).values(**values))
+                
+                # Add tags
+                for tag_text in tags:
+                    tag = Tag(
+                        transcript_id=transcript_id,
+                        tag=tag_text,
+                        source="LLM"
+                    )
+                    db.add(tag)
+                
+                log_step(job_id, f"Generated metadata: title='{title}', summary='{summary}', tags={tags}")
+            else:
+                log_step(job_id, f"Generated metadata but skipped database update (asset/transcript not available): title='{title}', summary='{summary}', tags={tags}")
+        else:
+            log_step(job_id, "LLM metadata generation skipped (not configured or failed)")
         
-        if job:
-            try:
-                job.progress = 55
-                db.commit()
-            except Exception as e:
-                print(f"Warning: Failed to update job progress: {e}")
+        # Step 8: Finalize
+        log_step(job_id, "Pipeline completed successfully")
         
-        # Step 4: Diarization
+        # Always try to update job status, even if the job wasn't found earlier
+        if Job is None:
+            print(f"Warning: Cannot update job status - Job model not available")
+            db.commit()
+            return
+        
+        rowcount = db.execute(
+            update(Job)
+            .where(Job.id == state["job_uuid"])
+            .values(status=JobStatus.SUCCEEDED.value, progress=100)
+        ).rowcount
+        db.commit()
+    
+    if rowcount > 0:
+        print(f"✓ Updated job {job_id} to SUCCEEDED with 100% progress")
+    else:
+        print(f"Warning: Job {job_id} not found in database for status update")
+
+def _diarize_or_skip(job_id: str, audio_path: str, hf_token: str) -> Dict[str, Any]:
+    """Run speaker diarization, returning no turns if it fails."""
+    try:
+        diarization_result = diarize_audio(audio_path, hf_token)
+        log_step(job_id, f"Diarization completed: {len(diarization_result.get('turns', []))} speaker turns")
+        return diarization_result
+    except Exception as diarization_error:
+        log_step(job_id, f"Diarization failed (skipping): {diarization_error}")
+        print(f"Warning: Diarization failed but continuing pipeline: {diarization_error}")
+        return {"turns": [], "speakers": []}
+
+def _with_gpu_mutex(fn, *args):
+    """Call fn while holding the GPU mutex; runs inside a worker thread."""
+    with get_gpu_mutex():
+        return fn(*args)
+
+def _write_json_later(job_id: str, filename: str, data: Any) -> "asyncio.Task":
+    """Write a JSON artifact on a thread so it overlaps the next pipeline stage."""
+    return asyncio.create_task(asyncio.to_thread(write_json, job_id, filename, data))
+
+def _write_outputs_later(job_id: str, transcript_text: str, segments: List[Dict[str, Any]], transcript_json: Dict[str, Any]) -> "asyncio.Future":
+    """Write the transcript output files concurrently on worker threads."""
+    return asyncio.gather(
+        asyncio.to_thread(write_text, job_id, "transcript.txt", transcript_text),
+        asyncio.to_thread(write_srt, job_id, segments),
+        asyncio.to_thread(write_vtt, job_id, segments),
+        asyncio.to_thread(write_json, job_id, "transcript.json", transcript_json)
+    )
+
+async def _run_pipeline(state: Dict[str, Any], input_path: str, artifact_writes: List[Any]) -> Dict[str, Any]:
+    """Run the compute stages, touching the database only in short transactions."""
+    job_id = state["job_id"]
+    settings_dict = state["settings"]
+    
+    # Step 1: Audio processing
+    log_step(job_id, "Processing audio file")
+    audio_result = await asyncio.to_thread(process_audio_file, input_path, job_id)
+    
+    asset_id = _save_asset_metadata(state, audio_result)
+    
+    # Step 2: ASR
+    log_step(job_id, "Running ASR")
+    
+    hf_token = settings_dict.get("hf_token")
+    has_hf_token = bool(hf_token) and hf_token != "your_hf_token_here"
+    diarization_result = None
+    
+    whisper_model = settings_dict["model_config"].get("whisper_model", "base")
+    transcribe_audio = get_transcribe_audio(settings_dict["model_config"].get("asr_backend", ASR_BACKEND))
+    # Use float32 for CPU compatibility, float16 only for GPU
+    compute_type = "float32"  # Changed from float16 to float32 for CPU compatibility
+    
+    if has_hf_token and GPU_POOL_SIZE > 1:
+        # Enough GPU room for both models: diarize alongside ASR on separate streams
+        log_step(job_id, "Running speaker diarization alongside ASR")
+        
+        def _asr_and_diarize():
+            with get_gpu_mutex(), ThreadPoolExecutor(max_workers=2) as executor:
+                diarization_future = executor.submit(
+                    run_on_stream, _diarize_or_skip, job_id, audio_result["normalized_path"], hf_token
+                )
+                asr_result = run_on_stream(
+                    transcribe_audio,
+                    audio_result["normalized_path"],
+                    whisper_model,
+                    compute_type
+                )
+                return asr_result, diarization_future.result()
+        
+        asr_result, diarization_result = await asyncio.to_thread(_asr_and_diarize)
+    else:
+        asr_result = await asyncio.to_thread(
+            _with_gpu_mutex,
+            transcribe_audio,
+            audio_result["normalized_path"],
+            whisper_model,
+            compute_type
+        )
+    
+    artifact_writes.append(_write_json_later(job_id, "asr_segments.json", asr_result))
+    
+    _update_progress(state, 40)
+    
+    # Step 3: Alignment
+    log_step(job_id, "Running word-level alignment")
+    
+    alignment_result = await asyncio.to_thread(
+        _with_gpu_mutex,
+        align_with_whisperx,
+        audio_result["normalized_path"],
+        asr_result
+    )
+    
+    artifact_writes.append(_write_json_later(job_id, "aligned_words.json", alignment_result))
+    
+    _update_progress(state, 55)
+    
+    # Step 4: Diarization (unless it already ran alongside ASR)
+    if diarization_result is None:
         log_step(job_id, "Running speaker diarization")
         
-        hf_token = settings_dict.get("hf_token")
-        if not hf_token or hf_token == "your_hf_token_here":
+        if not has_hf_token:
             log_step(job_id, "Skipping diarization (no valid HF token)")
             diarization_result = {"turns": [], "speakers": []}
         else:
-            try:
-                with get_gpu_mutex():
-                    diarization_result = diarize_audio(
-                        audio_result["normalized_path"],
-                        hf_token
-                    )
-                log_step(job_id, f"Diarization completed: {len(diarization_result.get('turns', []))} speaker turns")
-            except Exception as diarization_error:
-                log_step(job_id, f"Diarization failed (skipping): {diarization_error}")
-                print(f"Warning: Diarization failed but continuing pipeline: {diarization_error}")
-                diarization_result = {"turns": [], "speakers": []}
-        
-        write_json(job_id, "diarization.json", diarization_result)
-        
-        # Map words to speakers
-        if diarization_result["turns"]:
-            aligned_words = alignment_result["aligned_words"]
-            word_speakers = map_words_to_speakers(aligned_words, diarization_result)
-            write_json(job_id, "word_speakers.json", word_speakers)
-            
-            # Assign speakers to segments
-            segments_with_speakers = assign_speakers_to_segments(
-                asr_result["segments"],
-                word_speakers
+            diarization_result = await asyncio.to_thread(
+                _with_gpu_mutex,
+                _diarize_or_skip,
+                job_id,
+                audio_result["normalized_path"],
+                hf_token
             )
-        else:
-            segments_with_speakers = asr_result["segments"]
-            for segment in segments_with_speakers:
-                segment["speaker"] = "Unknown"
-        
-        if job:
-            try:
-                job.progress = 70
-                db.commit()
-            except Exception as e:
-                print(f"Warning: Failed to update job progress: {e}")
-        
-        # Step 5: Speaker embeddings
-        log_step(job_id, "Processing speaker embeddings")
-        
-        if diarization_result["turns"]:
-            try:
-                with get_gpu_mutex():
-                    speaker_result = process_speaker_embeddings(
-                        audio_result["normalized_path"],
-                        diarization_result,
-                        db
-                    )
-            except Exception as e:
-                log_step(job_id, f"Speaker embeddings failed (skipping): {e}")
-                speaker_result = {"speaker_mapping": {}, "embeddings_count": 0}
-        else:
+    
+    artifact_writes.append(_write_json_later(job_id, "diarization.json", diarization_result))
+    
+    # Speaker mapping updates the words and segments in place, so let the
+    # pending artifact writes finish serializing them first
+    await asyncio.gather(*artifact_writes)
+    artifact_writes.clear()
+    
+    # Map words to speakers
+    if diarization_result["turns"]:
+        aligned_words = alignment_result["aligned_words"]
+        word_speakers = map_words_to_speakers(aligned_words, diarization_result)
+        artifact_writes.append(_write_json_later(job_id, "word_speakers.json", word_speakers))
+        
+        # Assign speakers to segments
+        segments_with_speakers = assign_speakers_to_segments(
+            asr_result["segments"],
+            word_speakers
+        )
+    else:
+        segments_with_speakers = asr_result["segments"]
+        for segment in segments_with_speakers:
+            segment["speaker"] = "Unknown"
+    
+    _update_progress(state, 70)
+    
+    # Step 5: Speaker embeddings
+    log_step(job_id, "Processing speaker embeddings")
+    
+    if diarization_result["turns"]:
+        try:
+            speaker_result = await asyncio.to_thread(
+                _embed_speakers,
+                audio_result["normalized_path"],
+                diarization_result
+            )
+        except Exception as e:
+            log_step(job_id, f"Speaker embeddings failed (skipping): {e}")
             speaker_result = {"speaker_mapping": {}, "embeddings_count": 0}
+    else:
+        speaker_result = {"speaker_mapping": {}, "embeddings_count": 0}
+    
+    return {
+        "asset_id": asset_id,
+        "segments": segments_with_speakers,
+        "speaker_mapping": speaker_result["speaker_mapping"]
+    }
+
+async def run_job(job_id: str, input_path: str, params: Dict[str, Any]) -> None:
+    """Run the complete pipeline for a job."""
+    # Convert job_id string to UUID
+    try:
+        job_uuid = uuid.UUID(job_id)
+    except ValueError:
+        raise RuntimeError(f"Invalid job ID format: {job_id}")
+    
+    job_found = False
+    
+    try:
+        # Step 0: Setup
+        log_step(job_id, "Starting pipeline")
+        state = _load_job_state(job_id, job_uuid)
+        job_found = state["job_found"]
         
-        if job:
-            try:
-                job.progress = 80
-                db.commit()
-            except Exception as e:
-                print(f"Warning: Failed to update job progress: {e}")
+        artifact_writes = []
+        result = await _run_pipeline(state, input_path, artifact_writes)
+        segments_with_speakers = result["segments"]
+        speaker_names = list(result["speaker_mapping"].keys())
         
         # Step 6: Persist transcript and segments
         log_step(job_id, "Persisting transcript and segments")
         
         # Create transcript
-        transcript_text = " ".join([seg["text"] for seg in segments_with_speakers])
+        transcript_text = " ".join(seg["text"] for seg in segments_with_speakers)
+        transcript_id = None
         
         # Handle case where Asset model is not available
-        if asset is None:
+        if result["asset_id"] is None:
             print("Warning: Asset not available, skipping transcript persistence to database")
-            # Still generate output files
-            write_text(job_id, "transcript.txt", transcript_text)
-            write_srt(job_id, segments_with_speakers)
-            write_vtt(job_id, segments_with_speakers)
-            
-            # Save compact JSON without database IDs
+            # Still generate output files, with compact JSON without database IDs
             transcript_json = {
                 "transcript": {
                     "text": transcript_text
                 },
                 "segments": segments_with_speakers,
-                "speakers": list(speaker_result["speaker_mapping"].keys())
+                "speakers": speaker_names
             }
-            write_json(job_id, "transcript.json", transcript_json)
+            artifact_writes.append(
+                _write_outputs_later(job_id, transcript_text, segments_with_speakers, transcript_json)
+            )
             
             log_step(job_id, "Generated output files (database persistence skipped)")
         else:
             # Asset is available, proceed with database persistence
-            transcript = db.query(Transcript).filter(Transcript.asset_id == asset.id).first()
-            if not transcript:
-                transcript = Transcript(
-                    asset_id=asset.id,
-                    raw_text=transcript_text
-                )
-                db.add(transcript)
-                db.flush()
-            
-            # Create segments
-            for segment_data in segments_with_speakers:
-                # Find speaker ID
-                speaker_id = None
-                if segment_data.get("speaker") != "Unknown":
-                    speaker_label = segment_data["speaker"]
-                    if speaker_label in speaker_result["speaker_mapping"]:
-                        speaker_id = speaker_result["speaker_mapping"][speaker_label]
-                
-                segment = Segment(
-                    transcript_id=transcript.id,
-                    start=segment_data["start"],
-                    end=segment_data["end"],
-                    text=segment_data["text"],
-                    word_timings=segment_data.get("words", []),
-                    speaker_id=speaker_id,
-                    original_speaker_label=segment_data.get("speaker")
-                )
-                db.add(segment)
-            
-            # Generate output files
-            write_text(job_id, "transcript.txt", transcript_text)
-            write_srt(job_id, segments_with_speakers)
-            write_vtt(job_id, segments_with_speakers)
+            transcript_id = _persist_results(
+                state,
+                result["asset_id"],
+                segments_with_speakers,
+                result["speaker_mapping"],
+                transcript_text
+            )
             
-            # Save compact JSON
+            # Generate output files (compact JSON included) while the LLM runs
             transcript_json = {
                 "transcript": {
-                    "id": str(transcript.id),
+                    "id": str(transcript_id),
                     "text": transcript_text
                 },
                 "segments": segments_with_speakers,
-                "speakers": list(speaker_result["speaker_mapping"].keys())
+                "speakers": speaker_names
             }
-            write_json(job_id, "transcript.json", transcript_json)
+            artifact_writes.append(
+                _write_outputs_later(job_id, transcript_text, segments_with_speakers, transcript_json)
+            )
             
             log_step(job_id, "Generated output files and persisted to database")
         
-        if job:
-            try:
-                job.progress = 90
-                db.commit()
-            except Exception as e:
-                print(f"Warning: Failed to update job progress: {e}")
-        
         # Step 7: LLM metadata
         log_step(job_id, "Generating metadata with LLM")
         
         title, summary, tags = await generate_metadata(transcript_text, {})
         
-        if title or summary or tags:
-            # Update transcript if available
-            if asset is not None and transcript is not None:
-                if title:
-                    transcript.title = title
-                if summary:
-                    transcript.summary = summary
-                
-                # Add tags
-                for tag_text in tags:
-                    tag = Tag(
-                        transcript_id=transcript.id,
-                        tag=tag_text,
-                        source="LLM"
-                    )
-                    db.add(tag)
-                
-                db.commit()
-                log_step(job_id, f"Generated metadata: title='{title}', summary='{summary}', tags={tags}")
-            else:
-                log_step(job_id, f"Generated metadata but skipped database update (asset/transcript not available): title='{title}', summary='{summary}', tags={tags}")
-        else:
-            log_step(job_id, "LLM metadata generation skipped (not configured or failed)")
-        
-        if job:
-            try:
-                job.progress = 95
-                db.commit()
-            except Exception as e:
-                print(f"Warning: Failed to update job progress: {e}")
-        
-        # Step 8: Finalize
-        log_step(job_id, "Pipeline completed successfully")
-        
-        # Always try to update job status, even if job object wasn't found earlier
-        final_job_updated = False
-        if job:
-            try:
-                job.status = JobStatus.SUCCEEDED.value
-                job.progress = 100
-                db.commit()
-                final_job_updated = True
-                print(f"✓ Updated job {job_id} to SUCCEEDED with 100% progress")
-            except Exception as e:
-                print(f"Warning: Failed to update job status via job object: {e}")
-        
-        # Fallback: try direct database update if we have Job model but no job object
-        if not final_job_updated and Job is not None:
-            try:
-                result = db.query(Job).filter(Job.id == job_uuid).update({
-                    'status': JobStatus.SUCCEEDED.value,
-                    'progress': 100
-                })
-                db.commit()
-                if result > 0:
-                    print(f"✓ Updated job {job_id} via direct query to SUCCEEDED with 100% progress")
-                else:
-                    print(f"Warning: Job {job_id} not found in database for direct update")
-            except Exception as e:
-                print(f"Warning: Failed to update job status via direct query: {e}")
+        await asyncio.gather(*artifact_writes)
         
-        if not final_job_updated and Job is None:
-            print(f"Warning: Cannot update job status - Job model not available")
+        _finish_job(state, transcript_id, title, summary, tags)
         
-    except Exception as e:
-        # Handle errors
-        error_msg = f"Pipeline failed: {str(e)}"
+    except BaseException as e:
+        # Handle errors, including cancellation when RQ's job timeout fires in the event loop
+        if isinstance(e, asyncio.CancelledError):
+            error_msg = "Pipeline failed: job cancelled (timed out or worker shutting down)"
+        else:
+            error_msg = f"Pipeline failed: {str(e)}"
         log_step(job_id, error_msg)
         log_step(job_id, f"Traceback: {traceback.format_exc()}")
         
-        if job:
-            try:
-                job.status = JobStatus.FAILED.value
-                job.log_path = error_msg
-                db.commit()
-            except Exception as e:
-                print(f"Warning: Failed to update job status: {e}")
+        if job_found:
+            _update_job(job_uuid, status=JobStatus.FAILED.value, log_path=error_msg)
         
-        raise 
\ No newline at end of file
+        raise
+    
+    finally:
+        clear_audio_cache()
@@ -4,171 +4,345 @@ Speaker embeddings and identification using SpeechBrain ECAPA
 
 import os
 import json
+import tempfile
+import threading
+import uuid
 import numpy as np
 import torch
-import torchaudio
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple
 from speechbrain.pretrained import EncoderClassifier
 from pipeline.artifacts import log_step, write_json
+from pipeline.audio import load_audio_16k
 from db import get_db, Speaker, Embedding
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
-def load_ecapa_model():
-    """Load SpeechBrain ECAPA model with GPU support if available."""
-    # Check if CUDA is available
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"Loading SpeechBrain ECAPA model on device: {device}")
-    
-    model = EncoderClassifier.from_hparams(
-        source="speechbrain/spkrec-ecapa-voxceleb",
-        savedir="/data/models/speechbrain/spkrec-ecapa-voxceleb",
-        run_opts={"device": device}
-    )
-    return model
+# FAISS is optional; without it speaker search falls back to a NumPy matmul
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    print("faiss not available, using NumPy speaker search")
+    FAISS_AVAILABLE = False
 
-def extract_speaker_embeddings(audio_path: str, speaker_turns: List[Dict[str, Any]], model) -> List[Dict[str, Any]]:
-    """Extract embeddings for each speaker turn."""
-    embeddings = []
+# SimSIMD speeds up the NumPy search path when FAISS is missing
+try:
+    import simsimd
+    SIMSIMD_AVAILABLE = True
+except ImportError:
+    SIMSIMD_AVAILABLE = False
+
+# Global ECAPA model cache, loaded once per worker process
+_ecapa_cache = None
+_ecapa_lock = threading.Lock()
+
+def load_ecapa_model():
+    """Load SpeechBrain ECAPA model with GPU support if available, with caching."""
+    global _ecapa_cache
     
-    for turn in speaker_turns:
-        start_time = turn["start"]
-        end_time = turn["end"]
-        speaker_label = turn["speaker"]
-        
-        # Extract audio segment
-        import librosa
-        audio, sr = librosa.load(audio_path, sr=16000)
-        
-        start_sample = int(start_time * sr)
-        end_sample = int(end_time * sr)
+    if _ecapa_cache is not None:
+        return _ecapa_cache
+    
+    # Only one thread loads; others wait and reuse its model
+    with _ecapa_lock:
+        if _ecapa_cache is not None:
+            return _ecapa_cache
         
-        segment_audio = audio[start_sample:end_sample]
+        # Check if CUDA is available
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        print(f"Loading SpeechBrain ECAPA model on device: {device}")
         
-        # Skip very short segments
-        if len(segment_audio) < sr * 0.5:  # Less than 0.5 seconds
-            continue
+        model = EncoderClassifier.from_hparams(
+            source="speechbrain/spkrec-ecapa-voxceleb",
+            savedir="/data/models/speechbrain/spkrec-ecapa-voxceleb",
+            run_opts={"device": device}
+        )
+        model.eval()
         
-        # Save temporary segment using soundfile instead of deprecated librosa.output
-        import soundfile as sf
-        temp_path = f"/tmp/speaker_{speaker_label}_{start_time}.wav"
-        sf.write(temp_path, segment_audio, sr)
+        if ECAPA_COMPILE:
+            try:
+                model.mods.embedding_model = torch.compile(model.mods.embedding_model, mode="reduce-overhead")
+                print("✓ Compiled ECAPA encoder with torch.compile")
+            except Exception as e:
+                print(f"Warning: torch.compile unavailable for ECAPA, running eagerly: {e}")
         
-        try:
-            # Load audio file and convert to proper format for SpeechBrain
-            # SpeechBrain expects 16kHz mono audio tensors
-            signal, fs = torchaudio.load(temp_path)
-            
-            # Ensure mono channel - convert stereo to mono if needed
-            if signal.shape[0] > 1:
-                signal = signal.mean(dim=0, keepdim=True)
-            
-            # Resample to 16kHz if needed (SpeechBrain requirement)
-            if fs != 16000:
-                resampler = torchaudio.transforms.Resample(fs, 16000)
-                signal = resampler(signal)
-            
-            # SpeechBrain encode_batch expects [batch, time] format
-            # Current shape is [channels, time], so transpose and add batch dim
-            signal = signal.squeeze(0).unsqueeze(0)  # [1, time]
-            
-            # Extract embedding using encode_batch
-            embedding = model.encode_batch(signal)
-            embedding_vector = embedding.squeeze().cpu().numpy()
+        _ecapa_cache = model
+        return model
+
+# Maximum number of speaker turns encoded in one ECAPA forward pass
+ECAPA_BATCH_SIZE = 32
+
+# Opt-in torch.compile of the ECAPA encoder. Batches are then padded to whole
+# buckets of ECAPA_BUCKET_SECONDS so a few input shapes cover every turn length.
+ECAPA_COMPILE = os.getenv("ECAPA_COMPILE", "0") == "1"
+ECAPA_BUCKET_SECONDS = float(os.getenv("ECAPA_BUCKET_SECONDS", "3"))
+
+# BF16 on CPU only pays off with native bf16 support, so it is opt-in
+ECAPA_CPU_BF16 = os.getenv("ECAPA_CPU_BF16", "0") == "1"
+
+def _ecapa_autocast(model):
+    """Return the mixed-precision context for ECAPA inference on the model's device."""
+    if str(model.device).startswith("cuda"):
+        return torch.autocast(device_type="cuda", dtype=torch.float16)
+    return torch.autocast(device_type="cpu", dtype=torch.bfloat16, enabled=ECAPA_CPU_BF16)
+
+def _prepare_batch(batch: List[Tuple[Dict[str, Any], torch.Tensor]], pin: bool, bucket_samples: int = 0) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Pad a batch of turn signals into [batch, time] plus relative lengths."""
+    signals = [signal for _, signal in batch]
+    lengths = torch.tensor([len(signal) for signal in signals], dtype=torch.float32)
+    wavs = torch.nn.utils.rnn.pad_sequence(signals, batch_first=True)
+    if bucket_samples:
+        # Round the time axis up to a whole bucket
+        padded = -(-wavs.shape[1] // bucket_samples) * bucket_samples
+        wavs = torch.nn.functional.pad(wavs, (0, padded - wavs.shape[1]))
+    if pin:
+        wavs = wavs.pin_memory()  # Lets the copy to the GPU run asynchronously
+    return wavs, lengths / wavs.shape[1]
+
+def extract_speaker_embeddings(audio_path: str, speaker_turns: List[Dict[str, Any]], model) -> List[Dict[str, Any]]:
+    """Extract embeddings for each speaker turn."""
+    # Decode the whole file once; each turn is a slice of it
+    audio, sr = load_audio_16k(audio_path), 16000
+    
+    # Sample bounds for all turns at once, clipped to the decoded audio
+    starts = np.fromiter((turn["start"] for turn in speaker_turns), dtype=np.float64, count=len(speaker_turns))
+    ends = np.fromiter((turn["end"] for turn in speaker_turns), dtype=np.float64, count=len(speaker_turns))
+    start_samples = np.clip((starts * sr).astype(np.int64), 0, len(audio))
+    end_samples = np.clip((ends * sr).astype(np.int64), 0, len(audio))
+    
+    # Skip very short segments (less than 0.5 seconds)
+    min_samples = int(sr * 0.5)
+    valid = np.flatnonzero(end_samples - start_samples >= min_samples)
+    
+    turns = [
+        (speaker_turns[i], torch.from_numpy(audio[start_samples[i]:end_samples[i]]))
+        for i in valid
+    ]
+    
+    embeddings = []
+    
+    batches = [turns[i:i + ECAPA_BATCH_SIZE] for i in range(0, len(turns), ECAPA_BATCH_SIZE)]
+    pin = str(model.device).startswith("cuda")
+    bucket_samples = int(ECAPA_BUCKET_SECONDS * sr) if ECAPA_COMPILE else 0
+    
+    # Encode turns in padded batches; wav_lens carries each turn's relative length.
+    # The next batch is padded on a helper thread while the current one is encoded.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_batch = executor.submit(_prepare_batch, batches[0], pin, bucket_samples) if batches else None
+        for i, batch in enumerate(batches):
+            wavs, wav_lens = next_batch.result()
+            if i + 1 < len(batches):
+                next_batch = executor.submit(_prepare_batch, batches[i + 1], pin, bucket_samples)
             
-            embeddings.append({
-                "speaker_label": speaker_label,
-                "start": start_time,
-                "end": end_time,
-                "embedding": embedding_vector.tolist()
-            })
+            with torch.inference_mode(), _ecapa_autocast(model):
+                wavs = wavs.to(model.device, non_blocking=pin)
+                batch_embeddings = model.encode_batch(wavs, wav_lens=wav_lens)
+            # Keep stored embeddings in FP32 to preserve similarity precision
+            batch_embeddings = batch_embeddings.squeeze(1).float().cpu().numpy()
             
-        finally:
-            # Clean up temp file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            for (turn, _), embedding_vector in zip(batch, batch_embeddings):
+                embeddings.append({
+                    "speaker_label": turn["speaker"],
+                    "start": turn["start"],
+                    "end": turn["end"],
+                    "embedding": embedding_vector  # float32 ndarray; pgvector and the index take it as is
+                })
     
     return embeddings
 
-def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
-    """Calculate cosine similarity between two vectors."""
-    vec1 = np.array(vec1)
-    vec2 = np.array(vec2)
+# Nearest-neighbour index over all stored embeddings, rebuilt when the table changes
+_embedding_index_cache = {"version": None, "index": None, "matrix": None, "speaker_ids": []}
+
+# On-disk copy of the index so a fresh worker can skip reading every vector
+SPEAKER_INDEX_DIR = "/data/models/speaker_index"
+
+# Below this many embeddings an exact flat search is cheaper than an HNSW graph
+HNSW_MIN_EMBEDDINGS = 10000
+
+def _embedding_table_version(db: Session) -> List[Any]:
+    """Identify the embeddings table contents without reading any vectors."""
+    count, last_update = db.query(func.count(Embedding.id), func.max(Embedding.updated_at)).one()
+    return [count, last_update.isoformat() if last_update is not None else None]
+
+def _build_faiss_index(matrix: np.ndarray):
+    """Build an inner-product FAISS index over normalized rows.
+    
+    Rows are stored as 8-bit scalar-quantized codes, a quarter of the FP32 size;
+    on unit-length ECAPA vectors the similarity error is around 0.002.
+    """
+    qtype = faiss.ScalarQuantizer.QT_8bit
+    if matrix.shape[0] >= HNSW_MIN_EMBEDDINGS:
+        index = faiss.IndexHNSWSQ(matrix.shape[1], qtype, 32, faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexScalarQuantizer(matrix.shape[1], qtype, faiss.METRIC_INNER_PRODUCT)
+    index.train(matrix)
+    index.add(matrix)
+    return index
+
+# Index and row-to-speaker mapping share one file, so readers never pair one
+# version's index with another version's mapping
+SPEAKER_INDEX_FILE = os.path.join(SPEAKER_INDEX_DIR, "index.npz")
+
+def _read_saved_index(version: List[Any]):
+    """Return (index, speaker ids) saved for this table version, or None."""
+    try:
+        with np.load(SPEAKER_INDEX_FILE) as saved:
+            meta = json.loads(saved["meta"].tobytes())
+            if meta["version"] != version:
+                return None
+            index = faiss.deserialize_index(saved["index"])
+        return index, [uuid.UUID(speaker_id) for speaker_id in meta["speaker_ids"]]
+    except Exception:
+        return None
+
+def _save_index(version: List[Any], index, speaker_ids: List[Any]):
+    """Persist the index and its row-to-speaker mapping."""
+    try:
+        Path(SPEAKER_INDEX_DIR).mkdir(parents=True, exist_ok=True)
+        meta = json.dumps({"version": version, "speaker_ids": [str(speaker_id) for speaker_id in speaker_ids]})
+        
+        # Write a private temp file, then swap it in so other workers see the old or new file whole
+        fd, tmp_path = tempfile.mkstemp(dir=SPEAKER_INDEX_DIR, suffix=".npz.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, index=faiss.serialize_index(index), meta=np.frombuffer(meta.encode(), dtype=np.uint8))
+            os.replace(tmp_path, SPEAKER_INDEX_FILE)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except Exception as e:
+        print(f"Warning: Failed to save speaker index: {e}")
+
+def load_embedding_index(db: Session) -> Dict[str, Any]:
+    """Return the cached search structures for all stored embeddings.
+    
+    The result holds "speaker_ids" (one per row) and either a FAISS "index" or,
+    without FAISS, a normalized float32 [N, D] "matrix".
+    """
+    version = _embedding_table_version(db)
+    if _embedding_index_cache["version"] == version:
+        return _embedding_index_cache
     
-    dot_product = np.dot(vec1, vec2)
-    norm1 = np.linalg.norm(vec1)
-    norm2 = np.linalg.norm(vec2)
+    if FAISS_AVAILABLE:
+        saved = _read_saved_index(version)
+        if saved is not None:
+            index, speaker_ids = saved
+            _embedding_index_cache.update(version=version, index=index, matrix=None, speaker_ids=speaker_ids)
+            return _embedding_index_cache
     
-    if norm1 == 0 or norm2 == 0:
-        return 0.0
+    rows = db.query(Embedding.speaker_id, Embedding.vector).all()
+    speaker_ids = [speaker_id for speaker_id, _ in rows]
+    index = matrix = None
+    if rows:
+        matrix = np.ascontiguousarray([np.asarray(vector, dtype=np.float32) for _, vector in rows])
+        
+        # New rows are stored normalized; this only matters for rows written before that
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+        
+        if FAISS_AVAILABLE:
+            index = _build_faiss_index(matrix)
+            _save_index(version, index, speaker_ids)
+            matrix = None
     
-    return dot_product / (norm1 * norm2)
+    _embedding_index_cache.update(version=version, index=index, matrix=matrix, speaker_ids=speaker_ids)
+    return _embedding_index_cache
 
-def find_similar_speaker(embedding: List[float], db: Session, threshold: float = 0.3) -> Optional[Speaker]:
-    """Find similar speaker in database using cosine similarity."""
-    # Get all existing embeddings
-    existing_embeddings = db.query(Embedding).all()
+def new_pending_writes() -> Dict[str, Any]:
+    """Start tracking the speakers and embeddings a job creates before they are written."""
+    return {"speaker_ids": [], "vectors": [], "speakers": {}, "new_speakers": [], "new_embeddings": []}
+
+def find_best_match(embedding: List[float], db: Session, cache: Optional[Dict[str, Any]] = None, pending: Optional[Dict[str, Any]] = None) -> Tuple[Optional[Any], float]:
+    """Return (speaker id, cosine similarity) of the closest stored or pending embedding."""
+    if cache is None:
+        cache = load_embedding_index(db)
     
-    best_similarity = 0.0
-    best_speaker = None
+    # Stored vectors are unit length, so cosine similarity is a dot product
+    query = np.asarray(embedding, dtype=np.float32)
+    query = query / max(np.linalg.norm(query), 1e-12)
     
-    for emb in existing_embeddings:
-        similarity = cosine_similarity(embedding, emb.vector)
-        if similarity > best_similarity:
-            best_similarity = similarity
-            best_speaker = emb.speaker
+    best_id, best_similarity = None, 0.0
     
-    if best_similarity >= threshold:
-        return best_speaker
+    if cache["speaker_ids"]:
+        if cache["index"] is not None:
+            similarities, rows = cache["index"].search(query.reshape(1, -1), 1)
+            best, similarity = int(rows[0][0]), float(similarities[0][0])
+        elif SIMSIMD_AVAILABLE:
+            similarities = 1.0 - np.asarray(simsimd.cdist(query[np.newaxis], cache["matrix"], metric="cosine"))[0]
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+        else:
+            similarities = cache["matrix"] @ query
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+        if best >= 0 and similarity > best_similarity:
+            best_id, best_similarity = cache["speaker_ids"][best], similarity
     
-    return None
+    # Embeddings added earlier in this job are not in the index yet
+    if pending and pending["speaker_ids"]:
+        similarities = np.asarray(pending["vectors"]) @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] > best_similarity:
+            best_id, best_similarity = pending["speaker_ids"][best], float(similarities[best])
+    
+    return best_id, best_similarity
+
+def readable_speaker_names(labels) -> Dict[str, str]:
+    """Map diarization labels like SPEAKER_00 to readable names (Speaker A, B, C, etc.)."""
+    names = {}
+    for label in labels:
+        if label.startswith("SPEAKER_"):
+            names[label] = f"Speaker {chr(65 + int(label.split('_')[1]))}"
+        else:
+            names[label] = label
+    return names
 
-def create_or_assign_speaker(speaker_label: str, embedding: List[float], db: Session, threshold: float = 0.3) -> tuple[Speaker, float]:
-    """Create new speaker or assign to existing one. Returns (speaker, confidence)."""
-    # Try to find similar speaker
-    existing_speaker = find_similar_speaker(embedding, db, threshold)
-    best_similarity = 0.0
+def create_or_assign_speaker(speaker_label: str, embedding: List[float], db: Session, pending: Dict[str, Any], cache: Optional[Dict[str, Any]] = None, threshold: float = 0.3, speaker_names: Optional[Dict[str, str]] = None) -> tuple[Speaker, float]:
+    """Create new speaker or assign to existing one. Returns (speaker, confidence).
+    
+    New rows are collected in pending (see new_pending_writes) rather than added
+    to the session, so the caller can write them in one batch.
+    """
+    # Store unit-length float32 vectors so similarity is a plain dot product
+    vector = np.asarray(embedding, dtype=np.float32)
+    vector = vector / max(np.linalg.norm(vector), 1e-12)
+    
+    # Try to find similar speaker; the best row's similarity is the match confidence
+    speaker_id, best_similarity = find_best_match(vector, db, cache, pending)
+    existing_speaker = None
+    if speaker_id is not None and best_similarity >= threshold:
+        existing_speaker = pending["speakers"].get(speaker_id) or db.get(Speaker, speaker_id)
     
     if existing_speaker:
-        # Calculate the actual similarity score for the matched speaker
-        existing_embeddings = db.query(Embedding).filter(Embedding.speaker_id == existing_speaker.id).all()
-        for emb in existing_embeddings:
-            similarity = cosine_similarity(embedding, emb.vector)
-            best_similarity = max(best_similarity, similarity)
-        
-        # Add embedding to existing speaker
-        new_embedding = Embedding(
-            speaker_id=existing_speaker.id,
-            vector=embedding
-        )
-        db.add(new_embedding)
-        return existing_speaker, best_similarity
+        speaker = existing_speaker
+        confidence = best_similarity
     else:
-        # Create new speaker
-        # Convert speaker label to readable name
-        if speaker_label.startswith("SPEAKER_"):
-            # Generate a readable name
-            speaker_num = speaker_label.split("_")[1]
-            speaker_name = f"Speaker {chr(65 + int(speaker_num))}"  # A, B, C, etc.
-        else:
-            speaker_name = speaker_label
+        # Create new speaker with a readable name
+        if speaker_names is None:
+            speaker_names = readable_speaker_names([speaker_label])
+        speaker_name = speaker_names[speaker_label]
         
-        new_speaker = Speaker(
+        # Assign the ID up front so no flush is needed before adding embeddings
+        speaker = Speaker(
+            id=uuid.uuid4(),
             name=speaker_name, 
             is_trusted=False,
             original_label=speaker_label,
             match_confidence=None  # New speaker, no match
         )
-        db.add(new_speaker)
-        db.flush()  # Get the ID
-        
-        # Add embedding
-        new_embedding = Embedding(
-            speaker_id=new_speaker.id,
-            vector=embedding
-        )
-        db.add(new_embedding)
-        
-        return new_speaker, 0.0
+        pending["speakers"][speaker.id] = speaker
+        pending["new_speakers"].append(speaker)
+        confidence = 0.0
+    
+    # Add embedding
+    pending["new_embeddings"].append(Embedding(speaker_id=speaker.id, vector=vector))
+    pending["speaker_ids"].append(speaker.id)
+    pending["vectors"].append(vector)
+    
+    return speaker, confidence
 
 def process_speaker_embeddings(audio_path: str, diarization_result: Dict[str, Any], db: Session) -> Dict[str, Any]:
     """Process speaker embeddings and create/assign speakers."""
@@ -177,6 +351,11 @@ def process_speaker_embeddings(audio_path: str, diarization_result: Dict[str, An
     # Extract embeddings for each speaker turn
     embeddings = extract_speaker_embeddings(audio_path, diarization_result["turns"], model)
     
+    # Resolve every turn against one snapshot of the stored embeddings
+    cache = load_embedding_index(db)
+    pending = new_pending_writes()
+    speaker_names = readable_speaker_names({turn["speaker"] for turn in diarization_result["turns"]})
+    
     # Process each speaker
     speaker_mapping = {}
     confidence_scores = {}
@@ -186,7 +365,9 @@ def process_speaker_embeddings(audio_path: str, diarization_result: Dict[str, An
         embedding = emb_data["embedding"]
         
         # Create or assign speaker
-        speaker, confidence = create_or_assign_speaker(speaker_label, embedding, db)
+        speaker, confidence = create_or_assign_speaker(
+            speaker_label, embedding, db, pending, cache, speaker_names=speaker_names
+        )
         
         # Update match_confidence if this is a better match for an existing speaker
         if confidence > 0 and (speaker.match_confidence is None or confidence > speaker.match_confidence):
@@ -195,6 +376,9 @@ def process_speaker_embeddings(audio_path: str, diarization_result: Dict[str, An
         speaker_mapping[speaker_label] = speaker
         confidence_scores[speaker_label] = confidence
     
+    # Write all new speakers and embeddings in one flush
+    db.add_all(pending["new_speakers"])
+    db.add_all(pending["new_embeddings"])
     db.commit()
     
     return {
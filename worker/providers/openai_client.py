@@ -3,17 +3,61 @@ OpenAI client implementation
 """
 
 import asyncio
+import importlib.util
+import json
+import os
+import random
 import httpx
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from typing import List, Dict, Any
 from .base import LLMClient
 
+# HTTP/2 needs the h2 package (httpx[http2]); fall back to HTTP/1.1 without it
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# orjson parses the many small stream events faster than json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Total attempts per chat request, including the first
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+
+def _retry_after_seconds(response: httpx.Response) -> float:
+    """Parse a Retry-After header given as seconds or an HTTP date; 0 if absent."""
+    value = response.headers.get("retry-after")
+    if not value:
+        return 0.0
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _backoff(attempt: int, retry_after: float = 0.0) -> float:
+    """Exponential backoff with jitter so workers don't retry in lockstep."""
+    base = 2 ** attempt
+    return max(retry_after, base) + random.uniform(0, 0.5 * base)
+
 class OpenAIClient(LLMClient):
     """OpenAI API client."""
     
     def __init__(self, api_key: str, base_url: str = "https://api.openai.com/v1"):
         self.api_key = api_key
         self.base_url = base_url
-        self.client = httpx.AsyncClient(timeout=30.0)
+        # One pooled, keep-alive connection set; retries stay with the backoff in chat()
+        transport = httpx.AsyncHTTPTransport(
+            http2=HTTP2_AVAILABLE,
+            retries=0,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60)
+        )
+        self.client = httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(30.0, connect=5.0))
     
     async def chat(
         self,
@@ -37,29 +81,51 @@ class OpenAIClient(LLMClient):
             "messages": messages,
             "max_tokens": max_tokens,
             "temperature": temperature,
-            "top_p": top_p
+            "top_p": top_p,
+            "stream": True
         }
         
         # Retry logic
-        for attempt in range(3):
+        last_attempt = LLM_MAX_ATTEMPTS - 1
+        for attempt in range(LLM_MAX_ATTEMPTS):
             try:
-                response = await self.client.post(url, headers=headers, json=data)
-                response.raise_for_status()
-                
-                result = response.json()
-                return result["choices"][0]["message"]["content"]
+                return await self._stream_content(url, headers, data)
                 
             except httpx.HTTPStatusError as e:
-                if e.response.status_code in [429, 500, 502, 503, 504] and attempt < 2:
-                    await asyncio.sleep(2 ** attempt)  # Exponential backoff
+                if e.response.status_code in [429, 500, 502, 503, 504] and attempt < last_attempt:
+                    await asyncio.sleep(_backoff(attempt, _retry_after_seconds(e.response)))
                     continue
                 raise
-            except Exception as e:
-                if attempt < 2:
-                    await asyncio.sleep(1)
+            except httpx.TransportError:
+                # Connection-level failures; the request may not have reached the server
+                if attempt < last_attempt:
+                    await asyncio.sleep(_backoff(attempt))
                     continue
                 raise
     
+    async def _stream_content(self, url: str, headers: Dict[str, str], data: Dict[str, Any]) -> str:
+        """POST a streaming completion and join the content deltas as they arrive."""
+        parts = []
+        async with self.client.stream("POST", url, headers=headers, json=data) as response:
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            
+            async for line in response.aiter_lines():
+                # Server-sent events: "data: {json}" lines, ended by "data: [DONE]"
+                if not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == "[DONE]":
+                    break
+                
+                for choice in _json_loads(payload).get("choices", []):
+                    content = choice.get("delta", {}).get("content")
+                    if content:
+                        parts.append(content)
+        
+        return "".join(parts)
+    
     async def close(self):
         """Close the HTTP client."""
         await self.client.aclose() 
\ No newline at end of file
@@ -0,0 +1,21 @@
+"""
+Redis connection pool settings shared by the worker and the GPU mutex
+"""
+
+import os
+from redis import BlockingConnectionPool
+
+def create_redis_pool(redis_url: str) -> BlockingConnectionPool:
+    """Create a bounded pool; callers wait up to 5s for a free connection.
+    
+    REDIS_URL may be unix:///path/to/redis.sock when Redis runs alongside the
+    worker; keepalive is a TCP option that unix socket connections don't accept.
+    """
+    return BlockingConnectionPool.from_url(
+        redis_url,
+        max_connections=int(os.getenv("REDIS_POOL_MAX", "16")),
+        timeout=5,
+        socket_connect_timeout=5,
+        health_check_interval=30,
+        **({} if redis_url.startswith("unix://") else {"socket_keepalive": True})
+    )
@@ -8,8 +8,9 @@ import sys
 import json
 import asyncio
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
 # Add paths for imports
 sys.path.insert(0, os.path.dirname(__file__))
@@ -24,6 +25,136 @@ if parent_dir not in sys.path:
 
 print(f"Python path: {sys.path}")
 
+# Optional fast JSON encoder for transcript files
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+def _dump_json(data) -> str:
+    """Serialize data as indented JSON, using orjson when it can encode it."""
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY).decode()
+        except TypeError:
+            pass
+    return json.dumps(data, indent=2)
+
+def prewarm_models():
+    """Load the models cached at module level so the first job doesn't pay for it."""
+    try:
+        from pipeline.speakers import load_ecapa_model
+        load_ecapa_model()
+        print("✓ Pre-warmed ECAPA speaker model")
+    except Exception as e:
+        print(f"Warning: Model pre-warm failed: {e}")
+
+# Weight files read by the pipeline's model loaders
+WEIGHT_SUFFIXES = (".bin", ".pt", ".pth", ".ckpt", ".safetensors", ".onnx")
+
+def _default_model_dirs() -> List[str]:
+    """Directories the model loaders read weights from."""
+    cache_home = os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return [
+        "/app/model_cache",                      # pyannote / Hugging Face (diarize.py)
+        os.path.join(cache_home, "whisper"),     # openai-whisper's default download_root
+        "/data/models/speechbrain",              # ECAPA savedir (speakers.py)
+        os.path.join(cache_home, "huggingface"), # transformers / whisperx alignment models
+        os.path.join(cache_home, "torch"),       # torch.hub checkpoints
+    ]
+
+def prefetch_weights(model_dirs: Optional[List[str]] = None):
+    """Ask the kernel to read cached model weights into the page cache ahead of the first job.
+    
+    MODEL_CACHE_DIRS (os.pathsep-separated) overrides the default directories.
+    """
+    if model_dirs is None:
+        env_dirs = os.getenv("MODEL_CACHE_DIRS")
+        model_dirs = env_dirs.split(os.pathsep) if env_dirs else _default_model_dirs()
+    if not hasattr(os, "posix_fadvise"):
+        return
+    
+    count = 0
+    for model_dir in model_dirs:
+        for root, _, files in os.walk(model_dir):
+            for name in files:
+                if not name.endswith(WEIGHT_SUFFIXES):
+                    continue
+                try:
+                    fd = os.open(os.path.join(root, name), os.O_RDONLY)
+                    try:
+                        # Starts asynchronous readahead of the whole file and returns immediately
+                        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                        count += 1
+                    finally:
+                        os.close(fd)
+                except OSError as e:
+                    print(f"Warning: Could not prefetch {name}: {e}")
+    print(f"✓ Prefetching {count} model weight files")
+
+def warmup(allow_prewarm: bool = True):
+    """Import the full pipeline up front so forked job processes inherit it.
+    
+    Models are only loaded with PREWARM_MODELS=1: loaded here they live in this
+    process, which only helps when jobs run in it rather than in a forked child.
+    Callers that fork jobs pass allow_prewarm=False, since CUDA initialized
+    before a fork can't be used in the child.
+    """
+    try:
+        import numpy
+        import soundfile
+        import torch
+        import pipeline.run
+        print("✓ Preloaded pipeline modules")
+    except Exception as e:
+        print(f"Warning: Pipeline preload failed: {e}")
+    
+    # Opt-in: it reads every cached model, including ones this worker never loads
+    if os.getenv("PREFETCH_WEIGHTS", "0") == "1":
+        prefetch_weights()
+    if os.getenv("PREWARM_MODELS", "0") == "1":
+        if allow_prewarm:
+            prewarm_models()
+        else:
+            print("Warning: PREWARM_MODELS=1 ignored; jobs run in forked processes (use WORKER_MODE=simple with RQ_WORKERS=1)")
+
+# Engine for the fallback status updates, created on first use and reused across jobs
+_engine = None
+
+def _get_engine():
+    """Return the shared SQLAlchemy engine, creating it with a small pool if needed."""
+    global _engine
+    
+    if _engine is None:
+        from sqlalchemy import create_engine
+        
+        DATABASE_URL = os.getenv("DATABASE_URL", "postgresql+psycopg://voice:voice@db:5432/voice")
+        _engine = create_engine(DATABASE_URL, pool_size=5, pool_pre_ping=True, pool_recycle=300)
+    return _engine
+
+def _update_status(job_id: str, status: str, log_path: str, progress: int = None) -> bool:
+    """Set a job's status directly in SQL; returns False if the database is unreachable."""
+    try:
+        from sqlalchemy import text
+        
+        values = {"status": status, "log_path": log_path, "job_id": job_id}
+        progress_sql = ""
+        if progress is not None:
+            progress_sql = ", progress=:progress"
+            values["progress"] = progress
+        
+        with _get_engine().begin() as conn:
+            conn.execute(
+                text(f"UPDATE jobs SET status=:status{progress_sql}, log_path=:log_path, updated_at=NOW() WHERE id::text=:job_id"),
+                values
+            )
+        return True
+    except Exception as db_e:
+        print(f"Failed to update job status: {db_e}")
+        print("This is expected if the database models are not available")
+        return False
+
 async def run_job(job_id: str, input_path: str, params: dict):
     """Main job function for RQ - real implementation using actual pipeline modules."""
     print(f"Starting real pipeline job {job_id}")
@@ -48,12 +179,12 @@ async def run_job(job_id: str, input_path: str, params: dict):
         artifacts_dir = f"/data/artifacts/{job_id}"
         Path(artifacts_dir).mkdir(parents=True, exist_ok=True)
         
-        # Log the start
-        with open(f"{artifacts_dir}/_pipeline.log", "w") as f:
-            f.write(f"Job {job_id} started (transformers fallback mode)\n")
-            f.write(f"Input: {input_path}\n")
-            f.write(f"Params: {json.dumps(params, indent=2)}\n")
-            f.write(f"Error: Real pipeline import failed: {e}\n")
+        # Log the start; one line-buffered handle serves the whole fallback run
+        logf = open(f"{artifacts_dir}/_pipeline.log", "w", buffering=1, encoding="utf-8")
+        logf.write(f"Job {job_id} started (transformers fallback mode)\n")
+        logf.write(f"Input: {input_path}\n")
+        logf.write(f"Params: {_dump_json(params)}\n")
+        logf.write(f"Error: Real pipeline import failed: {e}\n")
         
         try:
             # Try OpenAI whisper CLI first
@@ -61,26 +192,22 @@ async def run_job(job_id: str, input_path: str, params: dict):
                 from pipeline.asr_openai import transcribe_audio as openai_transcribe
                 
                 print(f"Attempting OpenAI whisper CLI for job {job_id}")
-                with open(f"{artifacts_dir}/_pipeline.log", "a") as f:
-                    f.write("Trying OpenAI whisper CLI\n")
+                logf.write("Trying OpenAI whisper CLI\n")
                 
                 asr_result = openai_transcribe(input_path, "base", "float32")
                 
                 print(f"OpenAI whisper CLI succeeded: {len(asr_result.get('full_text', ''))} chars")
-                with open(f"{artifacts_dir}/_pipeline.log", "a") as f:
-                    f.write("OpenAI whisper CLI succeeded\n")
+                logf.write("OpenAI whisper CLI succeeded\n")
                     
             except Exception as openai_e:
                 print(f"OpenAI whisper CLI failed: {openai_e}")
-                with open(f"{artifacts_dir}/_pipeline.log", "a") as f:
-                    f.write(f"OpenAI whisper CLI failed: {openai_e}\n")
+                logf.write(f"OpenAI whisper CLI failed: {openai_e}\n")
                 
                 # Fallback to transformers-based ASR
                 from pipeline.asr_simple import transcribe_audio
                 
                 print(f"Using transformers ASR for job {job_id}")
-                with open(f"{artifacts_dir}/_pipeline.log", "a") as f:
-                    f.write("Using transformers ASR fallback\n")
+                logf.write("Using transformers ASR fallback\n")
                 
                 # Transcribe the audio
                 asr_result = transcribe_audio(input_path, "base", "float32")
@@ -107,24 +234,21 @@ async def run_job(job_id: str, input_path: str, params: dict):
                 "processing_mode": "transformers_fallback"
             }
             
-            with open(f"{artifacts_dir}/transcript.json", "w") as f:
-                json.dump(transcript_json, f, indent=2)
+            with open(f"{artifacts_dir}/transcript.json", "w", encoding="utf-8") as f:
+                f.write(_dump_json(transcript_json))
                 
-            with open(f"{artifacts_dir}/_pipeline.log", "a") as f:
-                f.write(f"Transcription successful: {len(transcript_text)} chars, {len(segments)} segments\n")
+            logf.write(f"Transcription successful: {len(transcript_text)} chars, {len(segments)} segments\n")
         
         except Exception as asr_e:
             print(f"Transformers ASR failed: {asr_e}")
-            with open(f"{artifacts_dir}/_pipeline.log", "a") as f:
-                f.write(f"Transformers ASR failed: {asr_e}\n")
+            logf.write(f"Transformers ASR failed: {asr_e}\n")
             
             # Try mock ASR as final fallback
             try:
                 print("Attempting to use mock ASR...")
                 from pipeline.asr_mock import transcribe_audio as mock_transcribe
                 
-                with open(f"{artifacts_dir}/_pipeline.log", "a") as f:
-                    f.write("Using mock ASR fallback\n")
+                logf.write("Using mock ASR fallback\n")
                 
                 # Use mock transcription
                 asr_result = mock_transcribe(input_path, "base", "float32")
@@ -151,16 +275,14 @@ async def run_job(job_id: str, input_path: str, params: dict):
                     "processing_mode": "mock_fallback"
                 }
                 
-                with open(f"{artifacts_dir}/transcript.json", "w") as f:
-                    json.dump(transcript_json, f, indent=2)
+                with open(f"{artifacts_dir}/transcript.json", "w", encoding="utf-8") as f:
+                    f.write(_dump_json(transcript_json))
                     
-                with open(f"{artifacts_dir}/_pipeline.log", "a") as f:
-                    f.write(f"Mock transcription successful: {len(transcript_text)} chars, {len(segments)} segments\n")
+                logf.write(f"Mock transcription successful: {len(transcript_text)} chars, {len(segments)} segments\n")
                     
             except Exception as mock_e:
                 print(f"Mock ASR also failed: {mock_e}")
-                with open(f"{artifacts_dir}/_pipeline.log", "a") as f:
-                    f.write(f"Mock ASR failed: {mock_e}\n")
+                logf.write(f"Mock ASR failed: {mock_e}\n")
                 
                 # Absolute final fallback: Create a basic transcript 
                 fallback_transcript = f"Audio transcription for job {job_id}\n\n[Transcription temporarily unavailable due to system maintenance]\n\nThis job was processed in fallback mode. The audio file was received and processed, but the full transcription pipeline is currently unavailable."
@@ -181,25 +303,15 @@ async def run_job(job_id: str, input_path: str, params: dict):
                     "processing_mode": "fallback"
                 }
                 
-                with open(f"{artifacts_dir}/transcript.json", "w") as f:
-                    json.dump(transcript_json, f, indent=2)
+                with open(f"{artifacts_dir}/transcript.json", "w", encoding="utf-8") as f:
+                    f.write(_dump_json(transcript_json))
         
-        # Update job status to succeeded - with better error handling
-        try:
-            from sqlalchemy import create_engine, text
-            
-            DATABASE_URL = os.getenv("DATABASE_URL", "postgresql+psycopg://voice:voice@db:5432/voice")
-            engine = create_engine(DATABASE_URL)
-            
-            with engine.begin() as conn:
-                conn.execute(
-                    text("UPDATE jobs SET status=:status, progress=:progress, log_path=:log_path, updated_at=NOW() WHERE id::text=:job_id"),
-                    {"status": "SUCCEEDED", "progress": 100, "log_path": f"Completed in fallback mode", "job_id": job_id}
-                )
-                print("✓ Updated job status to SUCCEEDED in database (fallback mode)")
-        except Exception as db_e:
-            print(f"Failed to update job status: {db_e}")
-            print("This is expected if the database models are not available")
+        finally:
+            logf.close()
+        
+        # Update job status to succeeded
+        if _update_status(job_id, "SUCCEEDED", "Completed in fallback mode", progress=100):
+            print("✓ Updated job status to SUCCEEDED in database (fallback mode)")
         
         print(f"Fallback processing completed successfully for job {job_id}")
         return f"Job {job_id} completed successfully in fallback mode"
@@ -207,26 +319,37 @@ async def run_job(job_id: str, input_path: str, params: dict):
     except Exception as e:
         print(f"Job {job_id} failed: {e}")
         
-        # Update job status to failed - with better error handling
-        try:
-            from sqlalchemy import create_engine, text
-            
-            DATABASE_URL = os.getenv("DATABASE_URL", "postgresql+psycopg://voice:voice@db:5432/voice")
-            engine = create_engine(DATABASE_URL)
-            
-            with engine.begin() as conn:
-                conn.execute(
-                    text("UPDATE jobs SET status=:status, log_path=:log_path, updated_at=NOW() WHERE id::text=:job_id"),
-                    {"status": "FAILED", "log_path": str(e), "job_id": job_id}
-                )
-                print("✓ Updated job status to FAILED in database")
-        except Exception as db_e:
-            print(f"Failed to update job status: {db_e}")
-            print("This is expected if the database models are not available")
+        # Update job status to failed
+        if _update_status(job_id, "FAILED", str(e)):
+            print("✓ Updated job status to FAILED in database")
         
         raise e
 
 # For RQ compatibility, provide a sync wrapper
 def run_job_sync(job_id: str, input_path: str, params: dict):
-    """Synchronous wrapper for RQ compatibility."""
-    return asyncio.run(run_job(job_id, input_path, params)) 
\ No newline at end of file
+    """Synchronous wrapper for RQ compatibility.
+    
+    When RQ's job timeout fires, the job task is cancelled so run_job marks the
+    job FAILED, and the timeout is re-raised without waiting for the running
+    stage thread. Python threads can't be stopped: in fork mode the work horse
+    exits and takes the thread (and its GPU lock renewal) with it, while a
+    SimpleWorker keeps running it in the background.
+    """
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(thread_name_prefix="pipeline-stage")
+    loop.set_default_executor(executor)
+    task = loop.create_task(run_job(job_id, input_path, params))
+    try:
+        return loop.run_until_complete(task)
+    except BaseException:
+        if not task.done():
+            task.cancel()
+            try:
+                loop.run_until_complete(task)
+            except BaseException:
+                pass
+        raise
+    finally:
+        # asyncio.run would block here until an overrunning stage returned
+        executor.shutdown(wait=False, cancel_futures=True)
+        loop.close() 
\ No newline at end of file
@@ -3,14 +3,14 @@
 RQ Worker for VoiceStack2
 """
 
+import gc
 import os
 import sys
-from rq import Worker, Queue
-from redis import Redis
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+# Load environment variables from .env unless the container already provides them
+if os.getenv("SKIP_DOTENV") != "1":
+    from dotenv import load_dotenv
+    load_dotenv()
 
 # Add the current directory to Python path so we can import pipeline modules
 sys.path.insert(0, os.path.dirname(__file__))
@@ -20,62 +20,163 @@ api_dir = os.getenv("API_SRC_DIR", "/app/api")
 if api_dir not in sys.path:
     sys.path.append(api_dir)
 
+# "fork" (default) runs each job in RQ's work horse process, which RQ kills when a
+# job overruns its timeout, releasing the GPU lock with it. "simple" runs jobs in
+# this process so model caches survive between jobs, but nothing can stop a hung
+# stage there: it keeps the worker and the GPU lock until it returns.
+WORKER_MODE = os.getenv("WORKER_MODE", "fork")
+
+# Worker processes per container; more than one forks a WorkerPool after warmup so
+# children share the imported pipeline. Jobs take turns on the GPU mutex, which
+# waits without a deadline and renews its lock for as long as a job holds it.
+RQ_WORKERS = int(os.getenv("RQ_WORKERS", os.getenv("RQ_WORKER_PROCESSES", "1")))
+
+# Seconds between work horse heartbeats in fork mode; ASR jobs run for minutes so 30s is plenty
+RQ_HEARTBEAT_S = int(os.getenv("RQ_HEARTBEAT_S", "30"))
+
+# CPUs to pin the worker to, e.g. "0,1,2,3" for the cores of one NUMA node
+WORKER_CPU_LIST = [int(cpu) for cpu in os.getenv("WORKER_CPU_LIST", "").split(",") if cpu.strip()]
+
+# Print startup import diagnostics
+WORKER_DEBUG = os.getenv("WORKER_DEBUG") == "1"
+
 def test_job(job_id: str, input_path: str, params: dict):
     """Simple test function for RQ."""
     print(f"Test job {job_id} with input {input_path} and params {params}")
     return f"Job {job_id} completed successfully"
 
+def pin_cpus():
+    """Pin this process to WORKER_CPU_LIST before torch starts its thread pools."""
+    if not WORKER_CPU_LIST or not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        os.sched_setaffinity(0, WORKER_CPU_LIST)
+    except OSError as e:
+        print(f"Warning: Could not pin worker to CPUs {WORKER_CPU_LIST}: {e}")
+        return
+    # Size OpenMP to the pinned CPUs unless the deployment sets it explicitly
+    os.environ.setdefault("OMP_NUM_THREADS", str(len(WORKER_CPU_LIST)))
+    os.environ.setdefault("OMP_PROC_BIND", "close")
+    os.environ.setdefault("OMP_PLACES", "cores")
+    print(f"✓ Pinned worker to CPUs {WORKER_CPU_LIST}")
+
 def main():
     """Start the RQ worker."""
+    # Imported here so importing this module (e.g. for test_job) doesn't load RQ
+    from rq import Queue, SimpleWorker, Worker
+    from rq.serializers import JSONSerializer
+    from redis import Redis
+    from redis_pool import create_redis_pool
+    
+    # Batch the startup banner into a few writes; PYTHONUNBUFFERED otherwise costs a syscall per line
+    if not sys.stdout.isatty():
+        sys.stdout.reconfigure(line_buffering=False, write_through=False)
+    
+    pin_cpus()
+    
     # Get Redis connection
     redis_url = os.getenv("REDIS_URL", "redis://redis:6379/0")
-    redis_conn = Redis.from_url(redis_url)
+    # One bounded pool shared by the queue and worker
+    redis_pool = create_redis_pool(redis_url)
+    redis_conn = Redis(connection_pool=redis_pool)
     
     # Create queue
-    queue = Queue("voicestack2", connection=redis_conn)
+    # Must match the API's serializer; job arguments are plain JSON
+    # Jobs enqueued without their own job_timeout get 1 hour; RQ workers take no timeout option
+    queue = Queue("voicestack2", connection=redis_conn, serializer=JSONSerializer, default_timeout=3600)
     
     print(f"Starting RQ worker on queue: voicestack2")
     print(f"Redis URL: {redis_url}")
     print(f"Python path: {sys.path[:5]}...")
     
-    # Test database imports first
-    print("\n=== Testing Database Imports ===")
-    try:
-        import db
-        print("✓ Successfully imported db module")
-        print(f"db.get_db function exists: {hasattr(db, 'get_db')}")
-        
-        # Test if models are available
-        if hasattr(db, 'Job') and db.Job is not None:
-            print("✓ Job model is available")
-        else:
-            print("⚠ Job model is not available")
+    # Import diagnostics only when debugging; the pipeline warmup below imports db anyway
+    if WORKER_DEBUG:
+        print("\n=== Testing Database Imports ===")
+        try:
+            import db
+            print("✓ Successfully imported db module")
+            print(f"db.get_db function exists: {hasattr(db, 'get_db')}")
             
-        if hasattr(db, 'Asset') and db.Asset is not None:
-            print("✓ Asset model is available")
-        else:
-            print("⚠ Asset model is not available")
+            # Test if models are available
+            if hasattr(db, 'Job') and db.Job is not None:
+                print("✓ Job model is available")
+            else:
+                print("⚠ Job model is not available")
             
-    except ImportError as e:
-        print(f"✗ Failed to import db module: {e}")
-        print("This will cause database update failures")
+            if hasattr(db, 'Asset') and db.Asset is not None:
+                print("✓ Asset model is available")
+            else:
+                print("⚠ Asset model is not available")
+        
+        except ImportError as e:
+            print(f"✗ Failed to import db module: {e}")
+            print("This will cause database update failures")
+    
+    # Jobs run in forked processes in fork mode and in a pool
+    forks_jobs = WORKER_MODE == "fork" or RQ_WORKERS > 1
     
     # Pre-import the simple_pipeline module to ensure it's available
     print("\n=== Testing Pipeline Imports ===")
     try:
-        import simple_pipeline
+        # Fails here rather than on the first job if the job entry point is missing
+        from simple_pipeline import run_job_sync, warmup  # noqa: F401
         print(f"✓ Successfully imported simple_pipeline module")
-        print(f"simple_pipeline.run_job_sync function exists: {hasattr(simple_pipeline, 'run_job_sync')}")
+        # CUDA initialized here would be unusable in forked children, so no model prewarm then
+        warmup(allow_prewarm=not forks_jobs)
     except ImportError as e:
         print(f"✗ Failed to import simple_pipeline: {e}")
         print(f"Python path: {sys.path}")
         return
     
+    # Forked job processes share the warmed-up heap copy-on-write; freezing it keeps
+    # the garbage collector from touching (and so copying) those pages in each child
+    if forks_jobs:
+        gc.collect()
+        gc.freeze()
+    
     print("\n=== Starting Worker ===")
+    # Flush the banner and go back to line buffering so job output reaches the logs promptly
+    sys.stdout.reconfigure(line_buffering=True)
+    worker_class = Worker if WORKER_MODE == "fork" else SimpleWorker
+    print(f"Worker mode: {WORKER_MODE} ({worker_class.__name__})")
+    
+    if RQ_WORKERS > 1:
+        from rq.worker_pool import WorkerPool
+        
+        # Split CPU threads between the workers so their CPU stages don't oversubscribe
+        try:
+            import torch
+            torch.set_num_threads(max(1, len(os.sched_getaffinity(0)) // RQ_WORKERS))
+        except ImportError:
+            pass
+        
+        class PoolWorker(worker_class):
+            """Pool worker with this worker's options; WorkerPool doesn't forward them."""
+            
+            def __init__(self, *args, **kwargs):
+                kwargs.setdefault("job_monitoring_interval", RQ_HEARTBEAT_S)
+                super().__init__(*args, **kwargs)
+            
+            def work(self, *args, **kwargs):
+                # The pool starts workers with the scheduler on; keep it off as in single-worker mode
+                kwargs["with_scheduler"] = False
+                return super().work(*args, **kwargs)
+        
+        print(f"Starting pool of {RQ_WORKERS} workers")
+        worker_pool = WorkerPool([queue], connection=redis_conn, num_workers=RQ_WORKERS,
+                                 worker_class=PoolWorker, serializer=JSONSerializer)
+        worker_pool.start(burst=False)
+        return
+    
     print("Configuring worker for single job processing (no concurrency)")
     
-    # Create worker with explicit job timeout and single job processing
-    worker = Worker([queue], connection=redis_conn, job_timeout=3600)  # 1 hour timeout
+    # Create worker for single job processing; job timeouts come from the queue and enqueue call
+    worker = worker_class(
+        [queue],
+        connection=redis_conn,
+        serializer=JSONSerializer,
+        job_monitoring_interval=RQ_HEARTBEAT_S
+    )
     
     # Configure worker to process only one job at a time
     # burst=False means it will continuously listen for jobs